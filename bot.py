@@ -1,26 +1,57 @@
 import os
+import sys
+import atexit
+import asyncio
+import heapq
+import functools
+import bisect
+import itertools
+import threading
 import logging
+import io
+import gzip
+import hashlib
 import json
+import mmap
 import html
 import re
 import csv
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Optional
 from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup,
+    InputMediaDocument, InputMediaPhoto, InputMediaVideo, InputMediaAudio
+)
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, ContextTypes,
-    CallbackQueryHandler, MessageHandler, filters, ConversationHandler
+    CallbackQueryHandler, MessageHandler, filters, ConversationHandler,
+    AIORateLimiter, BaseUpdateProcessor, TypeHandler, PicklePersistence, PersistenceInput
 )
 from telegram.constants import ParseMode
-from telegram.error import TelegramError
+from telegram.error import TelegramError, Forbidden, BadRequest, RetryAfter
 from telegram.helpers import escape_markdown
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # orjson ускоряет разбор данных, но бот работает и без него
+    orjson = None
+
 # Загрузка переменных окружения
 load_dotenv()
 TELEGRAM_BOT_TOKEN = (os.getenv('TELEGRAM_BOT_TOKEN') or '').strip()
 ADMIN_CHAT_ID_RAW = (os.getenv('ADMIN_CHAT_ID', '') or '').strip()
+ADMIN_IDS_RAW = (os.getenv('ADMIN_IDS', '') or '').strip()
 ADMIN_CHAT_ID = 0  # будет проинициализирован после настройки логирования
+# Если задан WEBHOOK_URL, Telegram сам присылает обновления на наш HTTPS-адрес вместо long polling
+WEBHOOK_URL = (os.getenv('WEBHOOK_URL') or '').strip().rstrip('/')
+WEBHOOK_LISTEN = (os.getenv('WEBHOOK_LISTEN') or '0.0.0.0').strip()
+WEBHOOK_PORT_RAW = (os.getenv('WEBHOOK_PORT') or '').strip()
+WEBHOOK_PATH = (os.getenv('WEBHOOK_PATH') or 'telegram').strip().strip('/')
+WEBHOOK_SECRET_TOKEN = (os.getenv('WEBHOOK_SECRET_TOKEN') or '').strip() or None
 
 # Директории
 BASE_DIR = os.path.join(os.getcwd(), 'clients')
@@ -29,15 +60,20 @@ LOGS_DIR = os.path.join(os.getcwd(), 'logs')
 for directory in [BASE_DIR, DATA_DIR, LOGS_DIR]:
     os.makedirs(directory, exist_ok=True)
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Настройка логирования: один форматтер на все обработчики
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO)
+for root_handler in logging.getLogger().handlers:
+    root_handler.setFormatter(LOG_FORMATTER)
 logger = logging.getLogger(__name__)
 file_handler = logging.FileHandler(os.path.join(LOGS_DIR, 'bot.log'))
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+file_handler.setFormatter(LOG_FORMATTER)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
 logger.addHandler(file_handler)
+# Консоль и файл подключены напрямую, корневой логгер сообщения бота повторно не обрабатывает
+logger.propagate = False
 
 try:
     ADMIN_CHAT_ID = int(ADMIN_CHAT_ID_RAW) if ADMIN_CHAT_ID_RAW else 0
@@ -45,32 +81,192 @@ except (TypeError, ValueError):
     ADMIN_CHAT_ID = 0
     logger.warning("Некорректное значение ADMIN_CHAT_ID='%s'. Уведомления администратору отключены.", ADMIN_CHAT_ID_RAW)
 
+try:
+    WEBHOOK_PORT = int(WEBHOOK_PORT_RAW) if WEBHOOK_PORT_RAW else 8443
+except ValueError:
+    WEBHOOK_PORT = 8443
+    logger.warning("Некорректное значение WEBHOOK_PORT='%s'. Используется порт 8443.", WEBHOOK_PORT_RAW)
+
+# Бот обрабатывает только сообщения и нажатия кнопок — остальные типы обновлений Telegram не присылает
+ALLOWED_UPDATES = ['message', 'callback_query']
+
+
+def parse_admin_ids(raw: str) -> frozenset:
+    admin_ids = {ADMIN_CHAT_ID} if ADMIN_CHAT_ID else set()
+    for chunk in raw.split(','):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        try:
+            admin_ids.add(int(chunk))
+        except ValueError:
+            logger.warning("Некорректный ID в ADMIN_IDS: '%s'", chunk)
+    return frozenset(admin_ids)
+
+
+# Кому открыта /admin: ADMIN_CHAT_ID и дополнительные ID из ADMIN_IDS через запятую
+ADMIN_IDS = parse_admin_ids(ADMIN_IDS_RAW)
+
 # Файлы данных
 PRICES_FILE = os.path.join(DATA_DIR, 'prices.json')
 REFERRALS_FILE = os.path.join(DATA_DIR, 'referrals.json')
-ORDERS_FILE = os.path.join(DATA_DIR, 'orders.json')
+ORDERS_FILE = os.path.join(DATA_DIR, 'orders.json.gz')  # растёт без ограничений, поэтому хранится сжатым
+LEGACY_ORDERS_FILE = os.path.join(DATA_DIR, 'orders.json')  # несжатый формат, переносится в .gz
+ORDERS_LOG_FILE = os.path.join(DATA_DIR, 'orders.log.jsonl')  # новые заказы между снимками orders.json.gz
+ORDERS_LOG_COMPACT_INTERVAL = 15 * 60
+GZIP_COMPRESS_LEVEL = 1
 FEEDBACKS_FILE = os.path.join(DATA_DIR, 'feedbacks.json')
 BONUSES_FILE = os.path.join(DATA_DIR, 'bonuses.json')
-USER_LOGS_FILE = os.path.join(DATA_DIR, 'user_logs.json')
+USER_LOGS_FILE = os.path.join(DATA_DIR, 'user_logs.json')  # устаревший формат, переносится в JSONL
+USER_LOGS_JSONL_FILE = os.path.join(DATA_DIR, 'user_logs.jsonl')
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+CONVERSATION_STATE_FILE = os.path.join(DATA_DIR, 'conversations.pickle')  # шаг диалога и черновики заказов
+CONVERSATION_STATE_FLUSH_INTERVAL = 30
 
 # Функции загрузки/сохранения с обработкой ошибок
+def parse_json_bytes(payload):
+    if orjson is not None:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # Стандартный модуль мягче (NaN, Infinity) — старые файлы не должны теряться
+            pass
+    return json.loads(bytes(payload))
+
+
 def load_json(file_path, default=None):
     try:
+        if file_path.endswith('.gz') and os.path.exists(file_path):
+            with gzip.open(file_path, 'rb') as f:
+                payload = f.read()
+            return parse_json_bytes(payload) if payload else (default or {})
         if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(file_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return default or {}
+                # Читаем через mmap без промежуточной копии строки
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        return parse_json_bytes(view)
         return default or {}
     except Exception as e:
         logger.error(f"Ошибка загрузки {file_path}: {e}")
         return default or {}
 
+def dump_json_bytes(data) -> bytes:
+    if orjson is not None:
+        try:
+            # OPT_NON_STR_KEYS — как json.dumps, приводим числовые ключи к строкам
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Например, целые за пределами 64 бит — отдаём стандартному модулю
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+_save_sequence = itertools.count()
+_write_lock = threading.Lock()
+_last_written_sequence = {}
+
+
+def write_file_atomic(file_path, payload: bytes, sequence: Optional[int] = None) -> bool:
+    # Пишем во временный файл и подменяем целиком — при сбое старый файл остаётся целым.
+    # Номер снимка не даёт запоздавшему потоку затереть более свежие данные.
+    tmp_path = f"{file_path}.tmp"
+    if file_path.endswith('.gz'):
+        # Сжатие — до захвата блокировки, чтобы не держать других писателей
+        payload = gzip.compress(payload, compresslevel=GZIP_COMPRESS_LEVEL)
+    with _write_lock:
+        if sequence is not None and sequence < _last_written_sequence.get(file_path, -1):
+            # Уже записан более свежий снимок — он содержит и эти данные
+            return True
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения {file_path}: {e}")
+            return False
+        if sequence is not None:
+            _last_written_sequence[file_path] = sequence
+        return True
+
+
 def save_json(file_path, data):
+    # Снимок заказов поглощает журнал новых заказов: сегменты удаляются только после успешной записи
+    log_segments = rotate_order_log() if file_path == ORDERS_FILE else ()
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        payload = dump_json_bytes(data)
     except Exception as e:
         logger.error(f"Ошибка сохранения {file_path}: {e}")
+        return
+    if write_file_atomic(file_path, payload, next(_save_sequence)):
+        discard_order_log_segments(log_segments)
+
+
+async def save_json_async(file_path, data):
+    # Сериализуем в цикле событий (данные не меняются под ногами), а запись уносим в поток
+    log_segments = rotate_order_log() if file_path == ORDERS_FILE else ()
+    try:
+        payload = dump_json_bytes(data)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения {file_path}: {e}")
+        return
+    if await asyncio.to_thread(write_file_atomic, file_path, payload, next(_save_sequence)):
+        discard_order_log_segments(log_segments)
+
+def now_timestamp() -> str:
+    # isoformat даёт тот же вид «ГГГГ-ММ-ДД ЧЧ:ММ:СС», что и strftime, но без разбора шаблона
+    return datetime.now().isoformat(' ', 'seconds')
+
+
+def short_timestamp(value: str, fallback: datetime) -> str:
+    """«ГГГГ-ММ-ДД ЧЧ:ММ» срезом сохранённой строки; strftime — только для старых форматов."""
+    if isinstance(value, str) and len(value) >= 16 and value[4] == '-' and value[10] in ' T':
+        return f"{value[:10]} {value[11:16]}"
+    return fallback.strftime('%Y-%m-%d %H:%M')
+
+
+# Отложенная запись: частые изменения одного файла склеиваются в одну запись раз в SAVE_DELAY_SECONDS
+SAVE_DELAY_SECONDS = 1.0
+_pending_saves = {}
+_save_tasks = set()
+
+
+def schedule_save(file_path, data) -> None:
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        save_json(file_path, data)
+        return
+    pending = _pending_saves.get(file_path)
+    if pending is not None:
+        # Запись уже запланирована — она возьмёт самые свежие данные
+        _pending_saves[file_path] = (pending[0], data)
+        return
+    handle = loop.call_later(SAVE_DELAY_SECONDS, _run_scheduled_save, file_path)
+    _pending_saves[file_path] = (handle, data)
+
+
+def _run_scheduled_save(file_path) -> None:
+    pending = _pending_saves.pop(file_path, None)
+    if pending is None:
+        return
+    task = asyncio.get_running_loop().create_task(save_json_async(file_path, pending[1]))
+    _save_tasks.add(task)
+    task.add_done_callback(_save_tasks.discard)
+
+
+def flush_pending_saves() -> None:
+    while _pending_saves:
+        file_path, (handle, data) = _pending_saves.popitem()
+        handle.cancel()
+        save_json(file_path, data)
+
+
+# Страховка на случай завершения процесса в обход post_shutdown
+atexit.register(flush_pending_saves)
+
 
 # Глобальные данные (инициализируются позже через initialize_storage)
 PRICES = {}
@@ -78,7 +274,6 @@ REFERALS = {}
 ORDERS = {}
 FEEDBACKS = {}
 BONUSES = {}
-USER_LOGS = {}
 USERS = {}
 
 # Глобальные данные по умолчанию
@@ -100,30 +295,35 @@ LEGACY_PRICE_KEYS = {
 }
 
 
-def normalize_prices(raw_prices):
-    normalized = {key: value.copy() for key, value in DEFAULT_PRICES.items()}
-    if not isinstance(raw_prices, dict):
-        return normalized
+_EMPTY_PRICE_ENTRY = {'base': 0, 'min': 0}
 
-    for raw_key, raw_value in raw_prices.items():
-        target_key = LEGACY_PRICE_KEYS.get(raw_key, raw_key)
-        if not isinstance(raw_value, dict):
-            continue
-        base = float(raw_value.get('base', 0) or 0)
-        minimum = float(raw_value.get('min', 0) or 0)
-        default_entry = DEFAULT_PRICES.get(target_key, {'base': 0, 'min': 0})
-        default_base = default_entry.get('base', 0)
-        default_min = default_entry.get('min', default_base)
-        if base <= 0:
-            base = default_base
-        base = max(base, default_base)
-        if minimum <= 0:
-            minimum = max(base, default_min)
-        minimum = max(minimum, base, default_min)
-        normalized[target_key] = {
-            'base': int(base),
-            'min': int(minimum),
-        }
+
+def normalize_prices(raw_prices):
+    # Сначала разбираем сохранённые цены, копии значений по умолчанию делаем только для недостающих типов
+    loaded = {}
+    if isinstance(raw_prices, dict):
+        for raw_key, raw_value in raw_prices.items():
+            target_key = LEGACY_PRICE_KEYS.get(raw_key, raw_key)
+            if not isinstance(raw_value, dict):
+                continue
+            base = float(raw_value.get('base', 0) or 0)
+            minimum = float(raw_value.get('min', 0) or 0)
+            default_entry = DEFAULT_PRICES.get(target_key, _EMPTY_PRICE_ENTRY)
+            default_base = default_entry.get('base', 0)
+            default_min = default_entry.get('min', default_base)
+            if base <= 0:
+                base = default_base
+            base = max(base, default_base)
+            if minimum <= 0:
+                minimum = max(base, default_min)
+            minimum = max(minimum, base, default_min)
+            loaded[sys.intern(target_key)] = {
+                'base': int(base),
+                'min': int(minimum),
+            }
+    # Порядок ключей прежний: типы по умолчанию, затем дополнительные из файла
+    normalized = {key: loaded.pop(key, None) or dict(value) for key, value in DEFAULT_PRICES.items()}
+    normalized.update(loaded)
     return normalized
 
 
@@ -191,15 +391,67 @@ ORDER_TYPES = {
     }
 }
 
+# Статичная часть описаний типов работ: ORDER_TYPES не меняется, поэтому тексты готовим заранее
+ORDER_DETAIL_TEXT = {
+    key: f"{val['icon']} *{val['name']}*\n\n{val['description']}\n{val['details']}\nПримеры: {', '.join(val['examples'])}"
+    for key, val in ORDER_TYPES.items()
+}
+PRICE_DETAIL_TEXT = {
+    key: "\n".join(filter(None, [
+        f"{val.get('icon', '')} *{val.get('name', '')}*",
+        val.get('description', ''),
+        val.get('details', ''),
+        f"Примеры: {', '.join(val.get('examples', []))}",
+    ]))
+    for key, val in ORDER_TYPES.items()
+}
+PRICE_LIST_HEADER = "💲 Прайс-лист (10% скидка сегодня! 🔥):\n\n"
+TOPIC_PROMPT_TEXT = "\n\n".join([
+    "✍️ *Введите тему задания.*",
+    "Опишите дисциплину, формат и основные акценты, чтобы мы сразу передали задачу профильному эксперту.",
+    "Если точной темы ещё нет — так и напишите, и мы поможем сформулировать лучший вариант.",
+])
+# Для части типов к приглашению добавляется пример темы
+TOPIC_PROMPT_TEXTS = {
+    'samostoyatelnye': TOPIC_PROMPT_TEXT + "\n\n" + (
+        "Например: «Эссе по конфликтологии о стратегиях медиации» или «Реферат по социальной работе о профилактике выгорания»."
+    ),
+}
+
 UPSELL_LABELS = {
     'prez': 'Презентация',
     'speech': 'Речь'
 }
 
+# Экранированные для HTML названия из неизменяемых справочников
+ORDER_TYPE_NAMES = {key: val['name'] for key, val in ORDER_TYPES.items()}
+ORDER_NAME_HTML = {key: html.escape(name) for key, name in ORDER_TYPE_NAMES.items()}
+UPSELL_LABELS_HTML = {key: html.escape(label) for key, label in UPSELL_LABELS.items()}
+# Готовая строка «Допы» для каждого набора опций: наборов всего 2^len(UPSELL_LABELS)
+UPSELL_HTML_BY_SET = {
+    frozenset(combo): ', '.join(UPSELL_LABELS_HTML[u] for u in combo) or 'нет'
+    for size in range(len(UPSELL_LABELS) + 1)
+    for combo in itertools.combinations(UPSELL_LABELS, size)
+}
+
+
+def upsell_summary_html(upsells) -> str:
+    upsells = upsells or ()
+    cached = UPSELL_HTML_BY_SET.get(frozenset(upsells))
+    if cached is None:
+        # Неизвестные опции из старых записей показываем как есть
+        cached = ', '.join(UPSELL_LABELS_HTML.get(u) or html.escape(u) for u in upsells) or 'нет'
+    return cached
+
 UPSELL_PRICES = {
     'prez': 2000,
     'speech': 1000,
 }
+UPSELL_PRICE_BY_SET = {
+    frozenset(combo): sum(UPSELL_PRICES.get(u, 0) for u in combo)
+    for size in range(len(UPSELL_LABELS) + 1)
+    for combo in itertools.combinations(UPSELL_LABELS, size)
+}
 
 EXPORT_FIELD_ORDER = [
     'user_id',
@@ -328,14 +580,27 @@ DEADLINE_PRESETS = [
 
 DEADLINE_LOOKUP = {item['key']: item for item in DEADLINE_PRESETS}
 DEFAULT_DEADLINE_KEY = '14d'
+DEADLINE_PROMPT_TEXT = "\n".join([
+    "⏰ *Выберите срок сдачи — чем спокойнее, тем выгоднее.*",
+    "_Мы закрепляем бонусы за ранний заказ — выбирайте комфортный вариант:_",
+    "",
+    *(f"{preset['label']} — {preset['badge']}" for preset in DEADLINE_PRESETS),
+])
+
+
+_DEFAULT_DEADLINE_PRESET = DEADLINE_LOOKUP[DEFAULT_DEADLINE_KEY]
 
 
 def get_deadline_preset(key):
-    return DEADLINE_LOOKUP.get(key) or DEADLINE_LOOKUP[DEFAULT_DEADLINE_KEY]
+    return DEADLINE_LOOKUP.get(key, _DEFAULT_DEADLINE_PRESET)
 
 
 def round_price(amount: float) -> int:
-    return int(max(0, (float(amount) + 25) // 50 * 50))
+    # Отбрасывание дробной части не меняет результат: floor((x + 25) / 50) == floor((int(x) + 25) / 50)
+    value = int(amount)
+    if value <= 0:
+        return 0
+    return (value + 25) // 50 * 50
 
 
 def get_status_entry_by_code(code: str) -> dict:
@@ -472,7 +737,7 @@ def register_referral(referrer_id: int, user) -> None:
         return
     if int(referrer_id) == int(user.id):
         return
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    timestamp = now_timestamp()
     REFERALS.setdefault('links', {})[str(user.id)] = str(referrer_id)
     update_referral_entry(
         str(referrer_id),
@@ -482,7 +747,6 @@ def register_referral(referrer_id: int, user) -> None:
         joined_at=timestamp,
         status='перешёл по ссылке',
     )
-    save_json(REFERRALS_FILE, REFERALS)
 
 
 def get_referrals_for_referrer(referrer_id: int) -> list:
@@ -492,17 +756,71 @@ def get_referrals_for_referrer(referrer_id: int) -> list:
     return []
 
 
+# Сводка «всего заказов / по статусам» для админки; None — пересчитать при следующем показе
+_order_stats_cache = None
+
+
+def invalidate_order_stats() -> None:
+    global _order_stats_cache
+    _order_stats_cache = None
+
+
+def get_order_stats() -> tuple:
+    global _order_stats_cache
+    if _order_stats_cache is None:
+        status_counts = {}
+        total_orders = 0
+        for user_orders in ORDERS.values():
+            if not isinstance(user_orders, list):
+                continue
+            for order in user_orders:
+                if not isinstance(order, dict):
+                    continue
+                total_orders += 1
+                status_label = order.get('status') or get_status_label(order.get('status_code'))
+                status_counts[status_label] = status_counts.get(status_label, 0) + 1
+        _order_stats_cache = (total_orders, sorted(status_counts.items()))
+    return _order_stats_cache
+
+
+def parse_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value)
+        except (OverflowError, OSError, ValueError):
+            return datetime.now()
+    if isinstance(value, str):
+        for pattern in (
+            '%Y-%m-%d %H:%M:%S',
+            '%Y-%m-%dT%H:%M:%S',
+            '%d.%m.%Y %H:%M',
+            '%Y-%m-%d',
+        ):
+            try:
+                return datetime.strptime(value, pattern)
+            except ValueError:
+                continue
+    return datetime.now()
+
+
 def normalize_order_record(order: dict, owner_id: Optional[str] = None) -> dict:
     if not isinstance(order, dict):
         return {}
     created_at = order.get('created_at') or order.get('date')
     if not created_at:
-        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        created_at = now_timestamp()
     order['created_at'] = created_at
     order.setdefault('updated_at', created_at)
+    if not isinstance(order.get('created_at_ms'), int):
+        order['created_at_ms'] = datetime_to_ms(parse_datetime(created_at))
     status_code = resolve_status_code(order.get('status_code') or order.get('status'))
+    status_label = get_status_label(status_code)
+    if order.get('status') != status_label:
+        invalidate_order_stats()
     order['status_code'] = status_code
-    order['status'] = get_status_label(status_code)
+    order['status'] = status_label
     if not isinstance(order.get('status_history'), list):
         order['status_history'] = []
     normalized_history = []
@@ -526,6 +844,14 @@ def normalize_order_record(order: dict, owner_id: Optional[str] = None) -> dict:
             'note': 'Создан автоматически',
         })
     order['status_history'] = normalized_history
+    # Ключи типа, срока и опций из JSON — новые строки; интернируем, чтобы словари совпадали по ссылке
+    for field in ('type', 'deadline_key'):
+        value = order.get(field)
+        if isinstance(value, str):
+            order[field] = sys.intern(value)
+    upsells = order.get('upsells')
+    if isinstance(upsells, list):
+        order['upsells'] = [sys.intern(item) if isinstance(item, str) else item for item in upsells]
     try:
         order['price'] = int(order.get('price', 0))
     except (TypeError, ValueError):
@@ -544,6 +870,105 @@ def normalize_order_record(order: dict, owner_id: Optional[str] = None) -> dict:
     return order
 
 
+def datetime_to_ms(value: datetime) -> int:
+    try:
+        return int(value.timestamp() * 1000)
+    except (OverflowError, OSError, ValueError):
+        return 0
+
+
+# Индекс заказов по времени создания: (-created_at_ms, user_id, order_id), новые заказы идут первыми
+ORDER_TIME_INDEX = []
+# Прямой доступ к заказу по (user_id, order_id) без перебора списка клиента
+ORDER_INDEX = {}
+# Уже экранированные части карточки заказа, которые не меняются после оформления
+ADMIN_ORDER_STATIC_HTML = {}
+# То же для карточки заказа в профиле клиента: статус и стоимость подставляются при каждом показе
+ORDER_DETAIL_STATIC_HTML = {}
+
+
+def order_index_key(user_id, order: dict) -> tuple:
+    return (-order.get('created_at_ms', 0), str(user_id), str(order.get('order_id')))
+
+
+# Следующий свободный номер заказа для каждого клиента, вычисляется при загрузке
+NEXT_ORDER_ID = {}
+
+
+def track_order_id(user_id, order: dict) -> None:
+    try:
+        order_id = int(order.get('order_id', 0))
+    except (TypeError, ValueError):
+        return
+    user_key = str(user_id)
+    if order_id >= NEXT_ORDER_ID.get(user_key, 1):
+        NEXT_ORDER_ID[user_key] = order_id + 1
+
+
+def order_id_sort_key(order: dict) -> int:
+    try:
+        return int(order.get('order_id', 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def register_order(user_id, order: dict) -> None:
+    key = order_index_key(user_id, order)
+    bisect.insort(ORDER_TIME_INDEX, key)
+    ORDER_INDEX[key[1:]] = order
+    track_order_id(user_id, order)
+    invalidate_order_stats()
+
+
+def drop_order(user_id, order: dict) -> None:
+    key = order_index_key(user_id, order)
+    position = bisect.bisect_left(ORDER_TIME_INDEX, key)
+    if position < len(ORDER_TIME_INDEX) and ORDER_TIME_INDEX[position] == key:
+        del ORDER_TIME_INDEX[position]
+    if ORDER_INDEX.get(key[1:]) is order:
+        del ORDER_INDEX[key[1:]]
+    ADMIN_ORDER_STATIC_HTML.pop(key[1:], None)
+    ORDER_DETAIL_STATIC_HTML.pop(key[1:], None)
+    invalidate_order_stats()
+
+
+def rebuild_order_index() -> None:
+    entries = []
+    ORDER_INDEX.clear()
+    NEXT_ORDER_ID.clear()
+    for user_id, orders in ORDERS.items():
+        if not isinstance(orders, list):
+            continue
+        for order in orders:
+            if isinstance(order, dict):
+                key = order_index_key(user_id, order)
+                entries.append(key)
+                # При дублях номера остаётся первый заказ — как при прежнем переборе списка
+                ORDER_INDEX.setdefault(key[1:], order)
+                track_order_id(user_id, order)
+    entries.sort()
+    ORDER_TIME_INDEX[:] = entries
+    invalidate_order_stats()
+
+
+# Пользователи в порядке последней активности: самые свежие в конце
+RECENT_USERS = OrderedDict()
+
+
+def rebuild_recent_users() -> None:
+    def last_seen_of(user_id):
+        value = USERS[user_id].get('last_seen') if isinstance(USERS[user_id], dict) else None
+        return parse_datetime(value) if value else datetime.min
+
+    RECENT_USERS.clear()
+    RECENT_USERS.update(dict.fromkeys(sorted(USERS, key=last_seen_of)))
+
+
+def touch_recent_user(user_id: str) -> None:
+    RECENT_USERS[user_id] = None
+    RECENT_USERS.move_to_end(user_id)
+
+
 def normalize_orders_storage() -> None:
     changed = False
     normalized_orders = {}
@@ -556,6 +981,8 @@ def normalize_orders_storage() -> None:
             if not isinstance(order, dict):
                 continue
             normalized_list.append(normalize_order_record(order, user_key))
+        # Списки клиентов храним упорядоченными по номеру: новые номера монотонны, и append сохраняет порядок
+        normalized_list.sort(key=order_id_sort_key)
         normalized_orders[user_key] = normalized_list
     if normalized_orders != ORDERS:
         ORDERS.clear()
@@ -565,8 +992,168 @@ def normalize_orders_storage() -> None:
         save_json(ORDERS_FILE, ORDERS)
 
 
+def migrate_user_logs() -> None:
+    """Однократно переносит старый user_logs.json в построчный user_logs.jsonl."""
+    if not os.path.exists(USER_LOGS_FILE):
+        return
+    # Перенос уже был: файл, появившийся снова (например, образец из репозитория), в журнал не дописываем
+    if os.path.exists(USER_LOGS_JSONL_FILE) or os.path.exists(f"{USER_LOGS_FILE}.migrated"):
+        return
+    legacy_logs = load_json(USER_LOGS_FILE)
+    try:
+        with open(USER_LOGS_JSONL_FILE, 'ab') as f:
+            if isinstance(legacy_logs, dict):
+                for user_id, entries in legacy_logs.items():
+                    if not isinstance(entries, list):
+                        continue
+                    for entry in entries:
+                        if isinstance(entry, dict):
+                            f.write(dump_json_bytes({'user_id': str(user_id), **entry}) + b'\n')
+        os.replace(USER_LOGS_FILE, f"{USER_LOGS_FILE}.migrated")
+    except OSError as e:
+        logger.error(f"Не удалось перенести {USER_LOGS_FILE} в JSONL: {e}")
+
+
+def migrate_orders_to_gzip() -> None:
+    """Однократно переносит orders.json в сжатый orders.json.gz."""
+    if not os.path.exists(LEGACY_ORDERS_FILE) or os.path.exists(ORDERS_FILE):
+        return
+    legacy_orders = load_json(LEGACY_ORDERS_FILE)
+    save_json(ORDERS_FILE, legacy_orders if isinstance(legacy_orders, dict) else {})
+    if not os.path.exists(ORDERS_FILE):
+        return
+    try:
+        os.replace(LEGACY_ORDERS_FILE, f"{LEGACY_ORDERS_FILE}.migrated")
+    except OSError as e:
+        logger.error(f"Не удалось переименовать {LEGACY_ORDERS_FILE}: {e}")
+
+
+def append_order_log_entry(entry: dict) -> bool:
+    try:
+        with open(ORDERS_LOG_FILE, 'ab') as f:
+            f.write(dump_json_bytes(entry) + b'\n')
+    except Exception as e:
+        logger.error(f"Ошибка записи в {ORDERS_LOG_FILE}: {e}")
+        return False
+    return True
+
+
+def append_order_log(user_id, order: dict) -> bool:
+    """Дописывает новый заказ одной строкой в журнал вместо перезаписи всего orders.json.gz."""
+    return append_order_log_entry({'user_id': str(user_id), 'order': order})
+
+
+def save_order_change(user_id, order: dict) -> None:
+    """Фиксирует изменённый заказ строкой в журнале; полный снимок — только если журнал недоступен."""
+    if not append_order_log_entry({'op': 'put', 'user_id': str(user_id), 'order': order}):
+        schedule_save(ORDERS_FILE, ORDERS)
+
+
+def save_order_removal(user_id, order_id) -> None:
+    if not append_order_log_entry({'op': 'del', 'user_id': str(user_id), 'order_id': str(order_id)}):
+        schedule_save(ORDERS_FILE, ORDERS)
+
+
+def order_log_paths() -> list:
+    # Сегменты — журналы, отложенные под снимок, который ещё не записан; текущий журнал идёт последним
+    prefix = os.path.basename(ORDERS_LOG_FILE) + '.'
+    try:
+        names = sorted(name for name in os.listdir(DATA_DIR) if name.startswith(prefix) and not name.endswith('.tmp'))
+    except OSError:
+        names = []
+    paths = [os.path.join(DATA_DIR, name) for name in names]
+    if os.path.exists(ORDERS_LOG_FILE):
+        paths.append(ORDERS_LOG_FILE)
+    return paths
+
+
+def rotate_order_log() -> list:
+    """Откладывает текущий журнал в сегмент; всё записанное до этого момента попадёт в снимок."""
+    paths = order_log_paths()
+    if paths and paths[-1] == ORDERS_LOG_FILE:
+        segment = f"{ORDERS_LOG_FILE}.{datetime.now():%Y%m%d%H%M%S%f}"
+        try:
+            os.replace(ORDERS_LOG_FILE, segment)
+        except OSError as e:
+            logger.error(f"Не удалось отложить {ORDERS_LOG_FILE}: {e}")
+            return paths[:-1]
+        paths[-1] = segment
+    return paths
+
+
+def discard_order_log_segments(paths) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Не удалось удалить {path}: {e}")
+
+
+def replay_order_log() -> int:
+    """Применяет к ORDERS записи журнала, сделанные после снимка.
+
+    Запись без op — новый заказ (добавляется, если его ещё нет), 'put' заменяет
+    заказ целиком, 'del' удаляет его.
+    """
+    replayed = 0
+    for path in order_log_paths():
+        try:
+            with open(path, 'rb') as f:
+                lines = f.readlines()
+        except OSError as e:
+            logger.error(f"Ошибка чтения {path}: {e}")
+            continue
+        for line in lines:
+            try:
+                entry = parse_json_bytes(line)
+            except ValueError:
+                # Строка, оборванная при аварийной остановке
+                logger.warning(f"Пропущена повреждённая строка в {path}")
+                continue
+            if not isinstance(entry, dict):
+                continue
+            user_key = str(entry.get('user_id'))
+            op = entry.get('op')
+            if op == 'del':
+                user_orders = ORDERS.get(user_key)
+                if not isinstance(user_orders, list):
+                    continue
+                order_id = str(entry.get('order_id'))
+                user_orders[:] = [item for item in user_orders if not (isinstance(item, dict) and str(item.get('order_id')) == order_id)]
+                if not user_orders:
+                    ORDERS.pop(user_key, None)
+                replayed += 1
+                continue
+            order = entry.get('order')
+            if not isinstance(order, dict):
+                continue
+            user_orders = ORDERS.setdefault(user_key, [])
+            if not isinstance(user_orders, list):
+                continue
+            order_id = str(order.get('order_id'))
+            position = next(
+                (i for i, item in enumerate(user_orders) if isinstance(item, dict) and str(item.get('order_id')) == order_id),
+                None,
+            )
+            if position is None:
+                user_orders.append(order)
+            elif op == 'put':
+                user_orders[position] = order
+            else:
+                continue
+            replayed += 1
+    return replayed
+
+
+async def compact_order_log(context: ContextTypes.DEFAULT_TYPE) -> None:
+    if os.path.exists(ORDERS_LOG_FILE):
+        schedule_save(ORDERS_FILE, ORDERS)
+
+
 def initialize_storage() -> None:
-    global PRICES, REFERALS, ORDERS, FEEDBACKS, BONUSES, USER_LOGS, USERS
+    global PRICES, REFERALS, ORDERS, FEEDBACKS, BONUSES, USERS
 
     PRICES = normalize_prices(load_json(PRICES_FILE, {}))
 
@@ -575,9 +1162,16 @@ def initialize_storage() -> None:
         REFERALS = {}
     REFERALS = normalize_referrals_structure(REFERALS)
 
+    migrate_orders_to_gzip()
     ORDERS = load_json(ORDERS_FILE)
     if not isinstance(ORDERS, dict):
         ORDERS = {}
+    if order_log_paths():
+        replayed = replay_order_log()
+        if replayed:
+            logger.info(f"Из журнала восстановлено заказов: {replayed}")
+        # Снимок поглощает журнал, и при следующем запуске повторять его не придётся
+        save_json(ORDERS_FILE, ORDERS)
 
     FEEDBACKS = load_json(FEEDBACKS_FILE)
     if not isinstance(FEEDBACKS, dict):
@@ -587,15 +1181,15 @@ def initialize_storage() -> None:
     if not isinstance(BONUSES, dict):
         BONUSES = {}
 
-    USER_LOGS = load_json(USER_LOGS_FILE)
-    if not isinstance(USER_LOGS, dict):
-        USER_LOGS = {}
+    migrate_user_logs()
 
     USERS = load_json(USERS_FILE)
     if not isinstance(USERS, dict):
         USERS = {}
 
     normalize_orders_storage()
+    rebuild_order_index()
+    rebuild_recent_users()
 
 
 initialize_storage()
@@ -608,8 +1202,10 @@ FAQ_ITEMS = [
     {'question': 'Скидки?', 'answer': '5-15% для постоянных, 10% на первый, рефералы.'},
     {'question': 'Отслеживание заказа?', 'answer': 'В профиле статусы, уведомления от менеджера.'}
 ]
+FAQ_ANSWER_TEXTS = [f"❓ {item['question']}\n\n{item['answer']}" for item in FAQ_ITEMS]
 
 current_pricing_mode = 'light'
+PRICING_MODE_MULTIPLIERS = {'light': 1.0, 'hard': 1.1}
 
 # Состояния
 (
@@ -640,17 +1236,141 @@ current_pricing_mode = 'light'
     PROFILE_BONUSES,
 ) = range(25)
 
-# Логирование действий пользователя
+# Поля заказа, которые копятся в user_data, пока клиент проходит шаги оформления
+ORDER_DRAFT_KEYS = (
+    'pending_files',
+    'upsells',
+    'topic',
+    'requirements',
+    'deadline_key',
+    'deadline_days',
+    'deadline_label',
+    'current_order_type',
+    'contact',
+    'contact_link',
+)
+# Брошенный диалог завершается через CONVERSATION_TIMEOUT, а его черновики удаляются из user_data
+CONVERSATION_TIMEOUT = timedelta(minutes=30)
+CONVERSATION_DRAFT_KEYS = ('cart', 'cart_total', *ORDER_DRAFT_KEYS, 'admin_state', 'admin_order_target')
+
+# Логирование действий пользователя: строки копятся в памяти цикла событий,
+# а на диск их пачкой пишет одна задача в пуле потоков
+USER_LOG_BUFFER_SIZE = 64 * 1024
+USER_LOG_FLUSH_INTERVAL = 5.0
+_user_log_pending = []
+_user_log_pending_size = 0
+_user_log_flush_handle = None
+_user_log_write_future = None
+# Файл журнала открывает только тот, кто держит блокировку: фоновая запись или финальный сброс
+_user_log_write_lock = threading.Lock()
+
+
+def append_user_log(log_entry: dict) -> None:
+    global _user_log_pending_size
+    line = dump_json_bytes(log_entry) + b'\n'
+    _user_log_pending.append(line)
+    _user_log_pending_size += len(line)
+    request_user_log_flush()
+
+
+def request_user_log_flush() -> None:
+    if _user_log_pending_size >= USER_LOG_BUFFER_SIZE:
+        flush_user_log_in_background()
+    else:
+        schedule_user_log_flush()
+
+
+def take_pending_user_log() -> list:
+    global _user_log_pending, _user_log_pending_size
+    lines = _user_log_pending
+    _user_log_pending = []
+    _user_log_pending_size = 0
+    return lines
+
+
+def write_user_log_lines(lines: list) -> None:
+    if not lines:
+        return
+    with _user_log_write_lock:
+        try:
+            with open(USER_LOGS_JSONL_FILE, 'ab') as f:
+                f.writelines(lines)
+        except OSError as e:
+            logger.error(f"Ошибка записи в {USER_LOGS_JSONL_FILE}: {e}")
+
+
+def schedule_user_log_flush() -> None:
+    global _user_log_flush_handle
+    if _user_log_flush_handle is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_user_log()
+        return
+    _user_log_flush_handle = loop.call_later(USER_LOG_FLUSH_INTERVAL, flush_user_log_in_background)
+
+
+def flush_user_log_in_background() -> None:
+    global _user_log_flush_handle, _user_log_write_future
+    if _user_log_flush_handle is not None:
+        _user_log_flush_handle.cancel()
+        _user_log_flush_handle = None
+    if not _user_log_pending:
+        return
+    if _user_log_write_future is not None:
+        # Предыдущая пачка ещё пишется — новые строки отправит её колбэк, порядок строк сохраняется
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_user_log()
+        return
+    _user_log_write_future = loop.run_in_executor(None, write_user_log_lines, take_pending_user_log())
+    _user_log_write_future.add_done_callback(_on_user_log_written)
+
+
+def _on_user_log_written(future) -> None:
+    global _user_log_write_future
+    _user_log_write_future = None
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Ошибка записи в {USER_LOGS_JSONL_FILE}: {future.exception()}")
+    if _user_log_pending:
+        request_user_log_flush()
+
+
+def flush_user_log() -> None:
+    global _user_log_flush_handle
+    if _user_log_flush_handle is not None:
+        _user_log_flush_handle.cancel()
+        _user_log_flush_handle = None
+    write_user_log_lines(take_pending_user_log())
+
+
+async def drain_user_log() -> None:
+    # Сначала дожидаемся пачки, которая уже пишется, иначе хвост журнала обгонит её
+    if _user_log_write_future is not None:
+        try:
+            await _user_log_write_future
+        except Exception:
+            pass
+    flush_user_log()
+
+
+atexit.register(flush_user_log)
+
+
 def log_user_action(user_id, username, action, full_name=None):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    log_entry = {'timestamp': timestamp, 'action': action}
+    timestamp = now_timestamp()
+    user_key = str(user_id)
+    log_entry = {'user_id': user_key, 'timestamp': timestamp, 'action': action}
     if username:
         log_entry['username'] = username
     if full_name:
         log_entry['full_name'] = full_name
-    USER_LOGS.setdefault(str(user_id), []).append(log_entry)
-    save_json(USER_LOGS_FILE, USER_LOGS)
-    profile = USERS.setdefault(str(user_id), {})
+    append_user_log(log_entry)
+    profile = USERS.setdefault(user_key, {})
+    touch_recent_user(user_key)
     profile.setdefault('first_seen', timestamp)
     profile['last_seen'] = timestamp
     profile['last_action'] = action
@@ -658,9 +1378,27 @@ def log_user_action(user_id, username, action, full_name=None):
         profile['username'] = username
     if full_name:
         profile['full_name'] = full_name
-    save_json(USERS_FILE, USERS)
-    display_name = username or full_name or str(user_id)
-    logger.info(f"Пользователь {user_id} ({display_name}): {action}")
+    schedule_save(USERS_FILE, USERS)
+    if logger.isEnabledFor(logging.INFO):
+        display_name = username or full_name or user_key
+        logger.info(f"Пользователь {user_id} ({display_name}): {action}")
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_background_tasks = set()
+
+
+def _on_background_task_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Фоновая задача завершилась с ошибкой: {task.exception()}")
+
+
+def spawn_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_background_task_done)
+    return task
+
 
 async def answer_callback_query(query, context):
     if not query:
@@ -668,30 +1406,40 @@ async def answer_callback_query(query, context):
     last_answered_id = context.user_data.get('_last_answered_query')
     if last_answered_id == query.id:
         return
-    await query.answer()
     context.user_data['_last_answered_query'] = query.id
+    # Ответ на callback уходит параллельно с правкой сообщения, а не перед ней
+    spawn_background(query.answer())
 
 
-def parse_datetime(value) -> datetime:
-    if isinstance(value, datetime):
-        return value
-    if isinstance(value, (int, float)):
-        try:
-            return datetime.fromtimestamp(value)
-        except (OverflowError, OSError, ValueError):
-            return datetime.now()
-    if isinstance(value, str):
-        for pattern in (
-            '%Y-%m-%d %H:%M:%S',
-            '%Y-%m-%dT%H:%M:%S',
-            '%d.%m.%Y %H:%M',
-            '%Y-%m-%d',
-        ):
-            try:
-                return datetime.strptime(value, pattern)
-            except ValueError:
-                continue
-    return datetime.now()
+# Повторное нажатие той же кнопки в пределах окна не повторяет запись заказа и уведомление менеджеру
+CLICK_DEBOUNCE_SECONDS = 2.0
+RECENT_CLICKS = OrderedDict()
+
+
+def is_repeated_click(user_id, data) -> bool:
+    now = time.monotonic()
+    # Нажатия лежат в порядке времени, поэтому устаревшие снимаются с начала
+    while RECENT_CLICKS:
+        oldest_key, clicked_at = next(iter(RECENT_CLICKS.items()))
+        if now - clicked_at < CLICK_DEBOUNCE_SECONDS:
+            break
+        del RECENT_CLICKS[oldest_key]
+    key = (user_id, data)
+    if key in RECENT_CLICKS:
+        return True
+    RECENT_CLICKS[key] = now
+    return False
+
+
+def debounce_clicks(handler):
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        query = update.callback_query
+        if query and update.effective_user and is_repeated_click(update.effective_user.id, query.data):
+            # На callback уже ответил маршрутизатор; None оставляет диалог в текущем состоянии
+            return None
+        return await handler(update, context, *args, **kwargs)
+    return wrapper
 
 
 def recalculate_bonus_entry(entry: dict) -> bool:
@@ -715,18 +1463,11 @@ def recalculate_bonus_entry(entry: dict) -> bool:
             total_credit += amount
         elif entry_type in BONUS_DEBIT_TYPES:
             total_debit += amount
-    balance = max(0, total_credit - total_debit)
-    changed = False
-    if entry.get('credited') != total_credit:
-        entry['credited'] = total_credit
-        changed = True
-    if entry.get('redeemed') != total_debit:
-        entry['redeemed'] = total_debit
-        changed = True
-    if entry.get('balance') != balance:
-        entry['balance'] = balance
-        changed = True
-    return changed
+    totals = (total_credit, total_debit, max(0, total_credit - total_debit))
+    if (entry.get('credited'), entry.get('redeemed'), entry.get('balance')) == totals:
+        return False
+    entry['credited'], entry['redeemed'], entry['balance'] = totals
+    return True
 
 
 def expire_outdated_bonuses(entry: dict) -> bool:
@@ -759,37 +1500,35 @@ def expire_outdated_bonuses(entry: dict) -> bool:
                 credit['remaining'] = available - consume
                 to_remove -= consume
     now = datetime.now()
+    expiration = timedelta(days=BONUS_EXPIRATION_DAYS)
     expired_total = 0
     for credit in ledger:
         remaining = credit.get('remaining', 0)
         if remaining <= 0:
             continue
-        if now - credit['timestamp'] >= timedelta(days=BONUS_EXPIRATION_DAYS):
+        if now - credit['timestamp'] >= expiration:
             expired_total += remaining
             credit['remaining'] = 0
             history.append({
                 'type': 'expire',
                 'amount': remaining,
                 'reason': 'Бонусы сгорели (30 дней без использования)',
-                'timestamp': now.strftime('%Y-%m-%d %H:%M:%S'),
+                'timestamp': now.isoformat(' ', 'seconds'),
             })
-    if expired_total:
-        entry['redeemed'] = int(entry.get('redeemed', 0)) + expired_total
-        entry['balance'] = max(0, int(entry.get('balance', 0)) - expired_total)
-        return True
-    return False
+    # Итоги пересчитывает recalculate_bonus_entry по обновлённой истории
+    return bool(expired_total)
 
 
 def ensure_bonus_account(user_id: str):
     user_key = str(user_id)
     entry = BONUSES.setdefault(user_key, {})
-    changed = False
-    if expire_outdated_bonuses(entry):
-        changed = True
-    if recalculate_bonus_entry(entry):
+    changed = recalculate_bonus_entry(entry)
+    # Сортировка истории для сгорания нужна, только если есть что сжигать
+    if entry['balance'] > 0 and expire_outdated_bonuses(entry):
+        recalculate_bonus_entry(entry)
         changed = True
     if changed:
-        save_json(BONUSES_FILE, BONUSES)
+        schedule_save(BONUSES_FILE, BONUSES)
     return entry
 
 
@@ -816,7 +1555,7 @@ def add_bonus_operation(user_id: str, amount: int, operation_type: str, reason:
         amount = min(amount, available_balance)
         if amount <= 0:
             return entry
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    timestamp = now_timestamp()
     entry.setdefault('history', []).append({
         'type': operation_type,
         'amount': amount,
@@ -824,7 +1563,7 @@ def add_bonus_operation(user_id: str, amount: int, operation_type: str, reason:
         'timestamp': timestamp,
     })
     recalculate_bonus_entry(entry)
-    save_json(BONUSES_FILE, BONUSES)
+    schedule_save(BONUSES_FILE, BONUSES)
     return entry
 
 
@@ -859,18 +1598,19 @@ def build_user_contact_link(user_id: int) -> str:
 
 def get_recent_user_profiles(limit: Optional[int] = None):
     records = []
-    for user_id, profile in USERS.items():
+    for user_id in itertools.islice(reversed(RECENT_USERS), limit):
+        profile = USERS.get(user_id) or {}
         last_seen = parse_datetime(profile.get('last_seen')) if profile.get('last_seen') else datetime.min
         records.append((last_seen, user_id, profile))
-    records.sort(key=lambda item: item[0], reverse=True)
-    if limit is not None:
-        records = records[:limit]
     return records
 
 
 async def safe_send_message(bot, chat_id: int, text: str, **kwargs):
     try:
         await bot.send_message(chat_id, text, **kwargs)
+    except Forbidden:
+        # Пользователь заблокировал бота — это ожидаемая ситуация
+        pass
     except TelegramError as exc:
         logger.warning(f"Не удалось отправить сообщение {chat_id}: {exc}")
 
@@ -891,7 +1631,7 @@ def get_feedback_entries(user_id: str):
 
 def save_feedback_entries(user_id: str, entries):
     FEEDBACKS[str(user_id)] = entries
-    save_json(FEEDBACKS_FILE, FEEDBACKS)
+    schedule_save(FEEDBACKS_FILE, FEEDBACKS)
 
 
 def truncate_for_button(text: str, limit: int = 32) -> str:
@@ -913,48 +1653,59 @@ def build_order_status(order: dict) -> str:
     return status
 
 
-def build_order_detail_text(order: dict) -> str:
-    order_name = ORDER_TYPES.get(order.get('type'), {}).get('name', 'Неизвестный тип')
-    topic = order.get('topic', 'Без темы')
-    deadline_display = order.get('deadline_label') or f"{order.get('deadline_days', '—')} дней"
-    upsell_titles = [UPSELL_LABELS.get(u, u) for u in order.get('upsells', [])]
-    upsell_text = ', '.join(upsell_titles) if upsell_titles else 'нет'
-    contact_display = html.escape(order.get('contact', 'Не указан'))
+def order_deadline_display(order: dict, missing_days='—') -> str:
+    return order.get('deadline_label') or f"{order.get('deadline_days', missing_days)} дней"
+
+
+def order_contact_html(order: dict) -> str:
+    contact_html = html.escape(order.get('contact', 'Не указан'))
     contact_link = order.get('contact_link')
     if contact_link:
-        contact_html = f"<a href=\"{html.escape(contact_link, quote=True)}\">{contact_display}</a>"
-    else:
-        contact_html = contact_display
-    requirements = html.escape(order.get('requirements', 'Нет'))
-    files_count = len(order.get('files', [])) if order.get('files') else 0
-    lines = [
-        f"<b>{html.escape(order_name)}</b>",
-        f"Тема: {html.escape(topic)}",
-        f"Статус: {html.escape(build_order_status(order))}",
-        f"Срок: {html.escape(deadline_display)}",
-        f"Контакт: {contact_html}",
-        f"Допы: {html.escape(upsell_text)}",
-        f"Стоимость: {order.get('price', 0)} ₽",
-        f"Требования: {requirements}",
-    ]
-    if files_count:
-        lines.append(f"Файлы: {files_count} шт.")
-    return "\n".join(lines)
+        return f"<a href=\"{html.escape(contact_link, quote=True)}\">{contact_html}</a>"
+    return contact_html
+
+
+def get_order_detail_static_html(user_id, order: dict) -> tuple:
+    key = (str(user_id), str(order.get('order_id')))
+    cached = ORDER_DETAIL_STATIC_HTML.get(key)
+    if cached is None:
+        order_name = ORDER_TYPE_NAMES.get(order.get('type'), 'Неизвестный тип')
+        topic = order.get('topic', 'Без темы')
+        deadline_display = order_deadline_display(order)
+        contact_html = order_contact_html(order)
+        files_count = len(order.get('files', [])) if order.get('files') else 0
+        cached = (
+            f"<b>{html.escape(order_name)}</b>\nТема: {html.escape(topic)}",
+            f"Срок: {html.escape(deadline_display)}\nКонтакт: {contact_html}\nДопы: {upsell_summary_html(order.get('upsells'))}",
+            f"Требования: {html.escape(order.get('requirements', 'Нет'))}"
+            + (f"\nФайлы: {files_count} шт." if files_count else ''),
+        )
+        ORDER_DETAIL_STATIC_HTML[key] = cached
+    return cached
+
+
+def build_order_detail_text(user_id, order: dict) -> str:
+    head, middle, tail = get_order_detail_static_html(user_id, order)
+    return (
+        f"{head}\nСтатус: {html.escape(build_order_status(order))}\n"
+        f"{middle}\nСтоимость: {order.get('price', 0)} ₽\n{tail}"
+    )
 
 
 def find_user_order(user_id: str, order_id: str):
-    user_orders = ORDERS.get(str(user_id), [])
-    for order in user_orders:
-        if str(order.get('order_id')) == str(order_id):
-            return order, user_orders
-    return None, user_orders
+    user_key = str(user_id)
+    return ORDER_INDEX.get((user_key, str(order_id))), ORDERS.get(user_key, [])
 
 
 async def edit_or_send(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, keyboard=None, parse_mode=ParseMode.HTML):
-    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+    if isinstance(keyboard, InlineKeyboardMarkup):
+        reply_markup = keyboard
+    else:
+        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
     if update.callback_query:
-        query = update.callback_query
-        await query.edit_message_text(
+        await edit_message_if_changed(
+            update.callback_query,
+            context,
             text,
             reply_markup=reply_markup,
             parse_mode=parse_mode,
@@ -977,42 +1728,234 @@ async def edit_or_send(update: Update, context: ContextTypes.DEFAULT_TYPE, text:
             disable_web_page_preview=True,
         )
 
+# Один проход регулярного выражения вместо цепочки проверок; порядок альтернатив повторяет приоритет
+_CONTACT_RE = re.compile(
+    r'(?P<url>(?i:https?://|tg://|mailto:))'
+    r'|(?P<telegram>(?i:telegram\.me/))'
+    r'|(?P<handle>@[A-Za-z0-9_]{4,}\Z)'
+    r'|(?P<email>[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\Z)'
+    r'|(?P<domain>(?i:vk\.com|t\.me))'
+)
+_CONTACT_LINK_BUILDERS = {
+    'url': lambda contact: contact,
+    'telegram': lambda contact: f"https://{contact.split('://', 1)[-1]}",
+    'handle': lambda contact: f"https://t.me/{contact[1:]}",
+    'email': lambda contact: f"mailto:{contact}",
+    'domain': lambda contact: f"https://{contact}",
+}
+
+
 def build_contact_link(contact_text):
     if not contact_text:
         return None
     contact = contact_text.strip()
     if not contact:
         return None
-    lowered = contact.lower()
-    if lowered.startswith(('http://', 'https://', 'tg://', 'mailto:')):
-        return contact
-    if lowered.startswith(('t.me/', 'telegram.me/')):
-        return f"https://{contact}" if lowered.startswith('t.me/') else f"https://{contact.split('://', 1)[-1]}"
-    if lowered.startswith('vk.com/'):
-        return f"https://{contact}"
-    if contact.startswith('@') and re.fullmatch(r'@[A-Za-z0-9_]{4,}', contact):
-        return f"https://t.me/{contact[1:]}"
-    if re.fullmatch(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}', contact):
-        return f"mailto:{contact}"
-    if lowered.startswith(('vk.com', 't.me')):
-        return f"https://{contact}"
-    return None
+    match = _CONTACT_RE.match(contact)
+    if match is None:
+        return None
+    return _CONTACT_LINK_BUILDERS[match.lastgroup](contact)
+
+
+@functools.lru_cache(maxsize=64)
+def back_button(callback_data: str, label: str = '⬅️ Назад') -> InlineKeyboardButton:
+    return InlineKeyboardButton(label, callback_data=callback_data)
+
+
+def is_message_not_modified(error: TelegramError) -> bool:
+    # PTB снимает префикс «Bad Request: » и делает первую букву заглавной — сверяем атрибут без str().lower()
+    return isinstance(error, BadRequest) and error.message.startswith('Message is not modified')
+
 
+async def edit_message_if_changed(query, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup=None, **kwargs) -> bool:
+    """Редактирует сообщение, только если текст или клавиатура отличаются от уже показанных.
 
+    Повторный клик по той же кнопке не тратит запрос к Telegram: текст сверяем по хешу
+    последней правки этого сообщения, клавиатуру — с той, что пришла вместе с callback.
+    Хеш — blake2b, а не hash(): user_data переживает перезапуск, а hash() строк меняется
+    от процесса к процессу.
+    """
+    message = query.message
+    edit_key = None
+    if message is not None:
+        digest = hashlib.blake2b(f"{kwargs.get('parse_mode')}\0{text}".encode(), digest_size=8).digest()
+        edit_key = (message.message_id, digest)
+        if context.user_data.get('_last_edit') == edit_key and message.reply_markup == reply_markup:
+            return False
+    await query.edit_message_text(text, reply_markup=reply_markup, **kwargs)
+    if edit_key is not None:
+        context.user_data['_last_edit'] = edit_key
+    return True
+
+
+# Статичные клавиатуры собираются один раз: разметка PTB неизменяема и её можно переиспользовать
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Сделать заказ", callback_data='make_order')],
+    [InlineKeyboardButton("💲 Прайс-лист", callback_data='price_list'), InlineKeyboardButton("🧮 Калькулятор", callback_data='price_calculator')],
+    [InlineKeyboardButton("👤 Профиль", callback_data='profile'), InlineKeyboardButton("❓ FAQ", callback_data='faq')],
+    [InlineKeyboardButton("📞 Администратор", url='https://t.me/Thisissaymoon')]
+])
+ORDER_TYPE_ROWS = tuple(
+    (InlineKeyboardButton(f"{val['icon']} {val['name']}", callback_data=f'type_{key}'),)
+    for key, val in ORDER_TYPES.items()
+)
+SELECT_ORDER_TYPE_MARKUP = InlineKeyboardMarkup(ORDER_TYPE_ROWS + ((back_button('back_to_main', "⬅️ Меню"),),))
+ORDER_DETAIL_MARKUPS = {
+    key: InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Заказать", callback_data=f'order_{key}')],
+        [InlineKeyboardButton("Назад", callback_data='select_order_type')]
+    ])
+    for key in ORDER_TYPES
+}
+ADD_UPSELL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Презентация (+2000₽)", callback_data='add_prez')],
+    [InlineKeyboardButton("Речь (+1000₽)", callback_data='add_speech')],
+    [InlineKeyboardButton("Без допов", callback_data='no_upsell')]
+])
+# Варианты клавиатуры допов по отмеченным опциям: (презентация, речь)
+UPSELL_CHOICE_MARKUPS = {
+    (prez, speech): InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"{'✅ ' if prez else ''}Презентация (+2000₽)", callback_data='add_prez')],
+        [InlineKeyboardButton(f"{'✅ ' if speech else ''}Речь (+1000₽)", callback_data='add_speech')],
+        [InlineKeyboardButton("Продолжить", callback_data='no_upsell')]
+    ])
+    for prez in (False, True)
+    for speech in (False, True)
+}
+ADD_ANOTHER_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Да", callback_data='add_another_yes')],
+    [InlineKeyboardButton("Нет, оформить", callback_data='confirm_cart')]
+])
+CART_HEADER_HTML = "<b>Ваша корзина. Подтвердите — зафиксируем персональный бонус:</b>"
+CART_ORDER_TEMPLATE = (
+    "{index}. <b>{name}</b> — {topic} — {price} ₽\n"
+    "• Срок: {deadline}\n"
+    "• Контакт: {contact}\n"
+    "• Допы: {upsells}"
+)
+CART_FOOTER_TEMPLATE = (
+    "<b>Итого: {total} ₽</b> — сумма с учётом допов и скидок.\n"
+    "После подтверждения наш менеджер свяжется с вами для финального согласования "
+    "и ответит на любые вопросы.\n"
+    "Подтвердить оформление?"
+)
+CONFIRM_CART_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Подтвердить", callback_data='place_order')],
+    [InlineKeyboardButton("Отменить", callback_data='cancel_cart')]
+])
+PRICE_LIST_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(f"Подробности {val['name']}", callback_data=f'price_detail_{key}')] for key, val in ORDER_TYPES.items()]
+    + [
+        [InlineKeyboardButton("🧮 Рассчитать цену", callback_data='price_calculator')],
+        [back_button('back_to_main', "⬅️ Меню")],
+    ]
+)
+PRICE_DETAIL_MARKUPS = {
+    key: InlineKeyboardMarkup([
+        [InlineKeyboardButton("Рассчитать", callback_data='price_calculator')],
+        [InlineKeyboardButton("Заказать", callback_data=f'type_{key}')],
+        [InlineKeyboardButton("Назад", callback_data='price_list')]
+    ])
+    for key in ORDER_TYPES
+}
+
+
+def build_calc_result_markup(order_type_key: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("📝 Заказать", callback_data=f'type_{order_type_key}')],
+        [InlineKeyboardButton("Пересчитать", callback_data='price_calculator'), InlineKeyboardButton("Меню", callback_data='back_to_main')]
+    ])
+
+
+CALC_RESULT_MARKUPS = {key: build_calc_result_markup(key) for key in ORDER_TYPES}
+CALC_COMPLEXITY_LABELS = {
+    '1.0': 'Простая (базовая)',
+    '1.1': 'Средняя (+10%)',
+    '1.3': 'Сложная (+30%)',
+}
+FILE_UPLOAD_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Готово", callback_data='files_done')],
+    [InlineKeyboardButton("⏭ Пропустить", callback_data='files_skip')]
+])
+FEEDBACK_INPUT_MARKUP = InlineKeyboardMarkup([[back_button('profile_feedbacks', "⬅️ Профиль")]])
+PROFILE_BACK_MARKUP = InlineKeyboardMarkup([[back_button('profile', "⬅️ Профиль")]])
+ADMIN_MENU_BACK_MARKUP = InlineKeyboardMarkup([[back_button('admin_menu', "⬅️ Меню")]])
+ADMIN_ORDERS_BACK_MARKUP = InlineKeyboardMarkup([[back_button('admin_orders', "⬅️ К списку")]])
+ADMIN_PRICES_BACK_MARKUP = InlineKeyboardMarkup([[back_button('admin_prices')]])
+
+
+# Сроки в клавиатуре идут парами по два в ряд
+_DEADLINE_ROW_PAIRS = tuple(
+    tuple(DEADLINE_PRESETS[i:i + 2]) for i in range(0, len(DEADLINE_PRESETS), 2)
+)
+
+
+@functools.lru_cache(maxsize=32)
 def build_deadline_keyboard(callback_prefix: str, include_back: bool = False, back_callback: Optional[str] = None):
-    rows = []
-    for i in range(0, len(DEADLINE_PRESETS), 2):
-        chunk = DEADLINE_PRESETS[i:i + 2]
-        row = [
-            InlineKeyboardButton(item['label'], callback_data=f"{callback_prefix}{item['key']}")
-            for item in chunk
-        ]
-        rows.append(row)
+    rows = [
+        [InlineKeyboardButton(item['label'], callback_data=f"{callback_prefix}{item['key']}") for item in pair]
+        for pair in _DEADLINE_ROW_PAIRS
+    ]
     if include_back and back_callback:
-        rows.append([InlineKeyboardButton('⬅️ Назад', callback_data=back_callback)])
+        rows.append([back_button(back_callback)])
     return InlineKeyboardMarkup(rows)
 
 
+# Клавиатуры сроков для шага после ввода темы: кнопка «Назад» ведёт к описанию выбранного типа
+TOPIC_DEADLINE_MARKUPS = {
+    key: build_deadline_keyboard('deadline_', include_back=True, back_callback=f'type_{key}')
+    for key in ORDER_TYPES
+}
+TOPIC_DEADLINE_DEFAULT_MARKUP = build_deadline_keyboard('deadline_', include_back=True, back_callback='select_order_type')
+CALC_TYPE_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(f"{val['icon']} {val['name']}", callback_data=f'calc_type_{key}')] for key, val in ORDER_TYPES.items()]
+    + [[back_button('back_to_main', "⬅️ Меню")]]
+)
+CALC_DEADLINE_MARKUP = build_deadline_keyboard('calc_dead_', include_back=True, back_callback='price_calculator')
+
+
+def build_complexity_keyboard(back_callback: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Простая (базовая)", callback_data='calc_comp_1.0')],
+        [InlineKeyboardButton("Средняя (+10%)", callback_data='calc_comp_1.1'), InlineKeyboardButton("Сложная (+30%)", callback_data='calc_comp_1.3')],
+        [InlineKeyboardButton("Назад", callback_data=back_callback)]
+    ])
+
+
+# «Назад» из выбора сложности возвращает к срокам выбранного типа
+COMPLEXITY_KB_BY_TYPE = {key: build_complexity_keyboard(f'calc_type_{key}') for key in ORDER_TYPES}
+COMPLEXITY_KB_DEFAULT = build_complexity_keyboard('price_calculator')
+FAQ_LIST_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(item['question'], callback_data=f'faq_{i}')] for i, item in enumerate(FAQ_ITEMS)]
+    + [[back_button('back_to_main', "⬅️ Меню")]]
+)
+FAQ_DETAIL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Назад к FAQ", callback_data='faq')],
+    [InlineKeyboardButton("Меню", callback_data='back_to_main')]
+])
+PROFILE_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📦 Мои заказы", callback_data='profile_orders')],
+    [InlineKeyboardButton("⭐ Отзывы", callback_data='profile_feedbacks')],
+    [InlineKeyboardButton("👥 Рефералы", callback_data='profile_referrals'), InlineKeyboardButton("🎁 Бонусы", callback_data='profile_bonuses')],
+    [back_button('back_to_main', "⬅️ Меню")],
+])
+ADMIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📦 Все заказы", callback_data='admin_orders'), InlineKeyboardButton("🔥 Последние", callback_data='admin_recent_orders')],
+    [InlineKeyboardButton("👥 Лиды", callback_data='admin_leads'), InlineKeyboardButton("🎁 Бонусы", callback_data='admin_bonuses')],
+    [InlineKeyboardButton("💲 Цены", callback_data='admin_prices'), InlineKeyboardButton("📤 Экспорт", callback_data='admin_export')],
+    [back_button('back_to_main', "⬅️ Выход")]
+])
+# Нижние ряды списков заказов в админке, к ним приклеиваются кнопки заказов
+ADMIN_ORDERS_FOOTER_ROWS = (
+    (InlineKeyboardButton("🔥 Последние", callback_data='admin_recent_orders'),),
+    (back_button('admin_menu', "⬅️ Меню"),),
+)
+ADMIN_RECENT_ORDERS_FOOTER_ROWS = (
+    (InlineKeyboardButton("📦 Все заказы", callback_data='admin_orders'),),
+    (back_button('admin_menu', "⬅️ Меню"),),
+)
+
+
 REQUIREMENTS_PROMPT_TEXT = (
     "📚 *Расскажите про дополнительные требования.*\n"
     "• Что указано в методичке или задании преподавателя.\n"
@@ -1026,11 +1969,10 @@ REQUIREMENTS_EXAMPLE_TEXT = (
 )
 
 
-def build_requirements_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton('💡 Подсказать, что написать', callback_data='requirements_hint')],
-        [InlineKeyboardButton('⏭ Пропустить', callback_data='requirements_skip')],
-    ])
+REQUIREMENTS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton('💡 Подсказать, что написать', callback_data='requirements_hint')],
+    [InlineKeyboardButton('⏭ Пропустить', callback_data='requirements_skip')],
+])
 
 
 def get_user_link(user):
@@ -1040,22 +1982,39 @@ def get_user_link(user):
 
 # Расчет цены
 def calculate_price(order_type_key: str, deadline_key: str, complexity_factor: float = 1.0) -> int:
-    if order_type_key not in PRICES:
+    return _calculate_price_cached(order_type_key, deadline_key, complexity_factor, current_pricing_mode)
+
+
+# Цена зависит только от аргументов, режима и PRICES; кеш сбрасывается в save_prices
+@functools.lru_cache(maxsize=256)
+def _calculate_price_cached(order_type_key: str, deadline_key: str, complexity_factor: float, pricing_mode: str) -> int:
+    pricing = PRICES.get(order_type_key)
+    if pricing is None:
         logger.error(f"Неизвестный тип: {order_type_key}")
         return 0
-    pricing = PRICES[order_type_key]
-    base = pricing.get('base', pricing.get('min', 0))
+    base = pricing.get('base')
+    if base is None:
+        base = pricing.get('min', 0)
     min_price = pricing.get('min', base)
-    preset = get_deadline_preset(deadline_key)
-    deadline_multiplier = preset.get('multiplier', 1.0)
-    mode_multiplier = 1.1 if current_pricing_mode == 'hard' else 1.0
+    deadline_multiplier = get_deadline_preset(deadline_key).get('multiplier', 1.0)
+    mode_multiplier = PRICING_MODE_MULTIPLIERS.get(pricing_mode, 1.0)
     raw_price = base * deadline_multiplier * complexity_factor * mode_multiplier
-    price = max(raw_price, min_price)
-    return round_price(price)
+    return round_price(max(raw_price, min_price))
+
+
+def calculate_price_grid(order_type_key: str, complexity_factor: float = 1.0) -> list:
+    """Цены типа работы для всех сроков — той же функцией, по которой считается цена для клиента."""
+    if order_type_key not in PRICES:
+        return []
+    return [
+        (preset, calculate_price(order_type_key, preset['key'], complexity_factor))
+        for preset in DEADLINE_PRESETS
+    ]
 
 
 def save_prices():
-    save_json(PRICES_FILE, PRICES)
+    _calculate_price_cached.cache_clear()
+    schedule_save(PRICES_FILE, PRICES)
 
 
 def adjust_price_value(order_type_key: str, field: str, delta: int) -> dict:
@@ -1109,10 +2068,32 @@ def set_price_value(order_type_key: str, base: Optional[int] = None, minimum: Op
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Ошибка: {context.error}")
     if ADMIN_CHAT_ID:
-        await context.bot.send_message(ADMIN_CHAT_ID, f"Ошибка: {context.error}")
+        try:
+            await context.bot.send_message(ADMIN_CHAT_ID, f"Ошибка: {context.error}")
+        except Forbidden:
+            pass
+        except TelegramError as exc:
+            logger.warning(f"Не удалось отправить ошибку администратору: {exc}")
+
+def remember_bot_username(bot_data: dict, bot_username: Optional[str]) -> None:
+    if not bot_username:
+        return
+    bot_data['bot_username'] = bot_username
+    bot_data['ref_link_template'] = f"https://t.me/{bot_username}?start={{}}"
+
+
+def build_ref_link(context: ContextTypes.DEFAULT_TYPE, user_id) -> str:
+    # Имя бота известно после initialize(), поэтому get_me здесь не нужен
+    ref_link_template = context.bot_data.get('ref_link_template')
+    if not ref_link_template:
+        remember_bot_username(context.bot_data, context.bot.username)
+        ref_link_template = context.bot_data['ref_link_template']
+    return ref_link_template.format(user_id)
+
 
 # Команда /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ud = context.user_data
     user = update.effective_user
     message = update.effective_message
     if user:
@@ -1122,27 +2103,30 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = message.text if message and message.text else ""
     args = text.split() if text else []
 
-    bot_username = context.bot.username
-    if not bot_username:
+    ref_link_template = context.bot_data.get('ref_link_template')
+    if not ref_link_template:
         try:
-            bot_username = (await context.bot.get_me()).username
+            remember_bot_username(context.bot_data, (await context.bot.get_me()).username)
         except TelegramError as exc:
             logger.warning("Не удалось получить информацию о боте: %s", exc)
-            bot_username = None
+        ref_link_template = context.bot_data.get('ref_link_template')
 
     ref_link = None
-    if bot_username and user:
-        ref_link = f"https://t.me/{bot_username}?start={user.id}"
-        context.user_data['ref_link'] = ref_link
+    if ref_link_template and user:
+        ref_link = ref_link_template.format(user.id)
+        ud['ref_link'] = ref_link
     else:
-        context.user_data.pop('ref_link', None)
+        ud.pop('ref_link', None)
     if user and len(args) > 1 and args[1].lstrip('-').isdigit():
         referrer_id = int(args[1])
         if referrer_id != user.id:
             register_referral(referrer_id, user)
-            context.user_data['referrer_id'] = referrer_id
+            schedule_save(REFERRALS_FILE, REFERALS)
+            ud['referrer_id'] = referrer_id
             try:
                 await context.bot.send_message(referrer_id, f"🎉 Новый реферал: {user.first_name}")
+            except Forbidden:
+                pass
             except TelegramError as exc:
                 logger.warning(f"Не удалось уведомить реферера {referrer_id}: {exc}")
     display_name = (user.first_name or user.full_name) if user else None
@@ -1164,22 +2148,14 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, message=
     else:
         logger.warning("Попытка открыть главное меню без данных пользователя: %s", update)
     text = message or "Выберите раздел:"
-    keyboard = [
-        [InlineKeyboardButton("📝 Сделать заказ", callback_data='make_order')],
-        [InlineKeyboardButton("💲 Прайс-лист", callback_data='price_list'), InlineKeyboardButton("🧮 Калькулятор", callback_data='price_calculator')],
-        [InlineKeyboardButton("👤 Профиль", callback_data='profile'), InlineKeyboardButton("❓ FAQ", callback_data='faq')],
-        [InlineKeyboardButton("📞 Администратор", url='https://t.me/Thisissaymoon')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = MAIN_MENU_MARKUP
     if update.callback_query:
         query = update.callback_query
         await answer_callback_query(query, context)
         try:
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+            await edit_message_if_changed(query, context, text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
         except TelegramError as e:
-            if "message is not modified" in str(e).lower():
-                pass
-            else:
+            if not is_message_not_modified(e):
                 logger.warning("Не удалось применить Markdown к сообщению меню: %s", e)
                 await query.edit_message_text(text, reply_markup=reply_markup)
     else:
@@ -1215,19 +2191,11 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
     user = update.effective_user
     log_user_action(user.id, user.username, f"Выбор в меню: {data}", user.full_name)
-    if data == 'make_order':
-        return await select_order_type(update, context)
-    elif data == 'price_list':
-        return await show_price_list(update, context)
-    elif data == 'price_calculator':
-        return await price_calculator(update, context)
-    elif data == 'profile':
-        return await show_profile(update, context)
-    elif data == 'faq':
-        return await show_faq(update, context)
+    handler = MAIN_MENU_ROUTES.get(data)
+    if handler:
+        return await handler(update, context)
     await query.edit_message_text("Неизвестная команда. Возвращаюсь в главное меню.")
     return await main_menu(update, context)
-    return SELECT_MAIN_MENU
 
 # Выбор типа заказа
 async def select_order_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1241,19 +2209,18 @@ async def select_order_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == 'back_to_main':
         return await main_menu(update, context)
     text = "Выберите тип работы (добавьте несколько в корзину для скидки!):"
-    keyboard = [[InlineKeyboardButton(f"{val['icon']} {val['name']}", callback_data=f'type_{key}')] for key, val in ORDER_TYPES.items()]
-    navigation_row = [InlineKeyboardButton("⬅️ Меню", callback_data='back_to_main')]
     current_type = context.user_data.get('current_order_type')
     if current_type in ORDER_TYPES:
-        navigation_row.append(InlineKeyboardButton("🔙 К описанию", callback_data=f'type_{current_type}'))
-    keyboard.append(navigation_row)
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = InlineKeyboardMarkup(ORDER_TYPE_ROWS + ((
+            back_button('back_to_main', "⬅️ Меню"),
+            InlineKeyboardButton("🔙 К описанию", callback_data=f'type_{current_type}'),
+        ),))
+    else:
+        reply_markup = SELECT_ORDER_TYPE_MARKUP
     try:
-        await query.edit_message_text(text, reply_markup=reply_markup)
+        await edit_message_if_changed(query, context, text, reply_markup=reply_markup)
     except TelegramError as e:
-        if "message is not modified" in str(e).lower():
-            pass
-        else:
+        if not is_message_not_modified(e):
             raise
     return SELECT_ORDER_TYPE
 
@@ -1265,17 +2232,8 @@ async def view_order_details(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if data.startswith('order_'):
         key = data[6:]
         context.user_data['current_order_type'] = key
-        prompt_lines = [
-            "✍️ *Введите тему задания.*",
-            "Опишите дисциплину, формат и основные акценты, чтобы мы сразу передали задачу профильному эксперту.",
-            "Если точной темы ещё нет — так и напишите, и мы поможем сформулировать лучший вариант.",
-        ]
-        if key == 'samostoyatelnye':
-            prompt_lines.append(
-                "Например: «Эссе по конфликтологии о стратегиях медиации» или «Реферат по социальной работе о профилактике выгорания»."
-            )
         await query.edit_message_text(
-            "\n\n".join(prompt_lines),
+            TOPIC_PROMPT_TEXTS.get(key, TOPIC_PROMPT_TEXT),
             parse_mode=ParseMode.MARKDOWN,
         )
         return INPUT_TOPIC
@@ -1286,22 +2244,14 @@ async def view_order_details(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if key not in ORDER_TYPES:
             await query.edit_message_text("Ошибка: неизвестный тип.")
             return SELECT_ORDER_TYPE
-        val = ORDER_TYPES[key]
         prices = PRICES.get(key, {})
         min_price = prices.get('min') or prices.get('base')
         price_line = f"Минимальная стоимость: {min_price} ₽ при комфортных сроках." if min_price else ""
-        text = (
-            f"{val['icon']} *{val['name']}*\n\n{val['description']}\n{val['details']}\n"
-            f"Примеры: {', '.join(val['examples'])}"
-        )
+        text = ORDER_DETAIL_TEXT[key]
         if price_line:
             text += f"\n\n{price_line}"
         text += "\n\nГотовы оформить заказ?"
-        keyboard = [
-            [InlineKeyboardButton("✅ Заказать", callback_data=f'order_{key}')],
-            [InlineKeyboardButton("Назад", callback_data='select_order_type')]
-        ]
-        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=ORDER_DETAIL_MARKUPS[key])
         return VIEW_ORDER_DETAILS
 
 # Ввод темы
@@ -1310,19 +2260,10 @@ async def input_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['topic'] = topic_text
     user = update.effective_user
     log_user_action(user.id, user.username, f"Тема: {update.message.text}", user.full_name)
-    descriptions = [
-        "⏰ *Выберите срок сдачи — чем спокойнее, тем выгоднее.*",
-        "_Мы закрепляем бонусы за ранний заказ — выбирайте комфортный вариант:_",
-        "",
-    ]
-    for preset in DEADLINE_PRESETS:
-        descriptions.append(f"{preset['label']} — {preset['badge']}")
-    text = "\n".join(descriptions)
-    back_target = context.user_data.get('current_order_type')
-    reply_markup = build_deadline_keyboard(
-        'deadline_',
-        include_back=True,
-        back_callback=f'type_{back_target}' if back_target else 'select_order_type'
+    text = DEADLINE_PROMPT_TEXT
+    reply_markup = TOPIC_DEADLINE_MARKUPS.get(
+        context.user_data.get('current_order_type'),
+        TOPIC_DEADLINE_DEFAULT_MARKUP,
     )
     await update.message.reply_text(
         text,
@@ -1335,22 +2276,22 @@ async def input_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Выбор срока
 async def select_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    ud = context.user_data
     await answer_callback_query(query, context)
-    data = query.data
-    if data.startswith('deadline_'):
-        key = data[9:]
+    prefix, _, key = query.data.partition('_')
+    if prefix == 'deadline':
         preset = get_deadline_preset(key)
-        context.user_data['deadline_key'] = key
-        context.user_data['deadline_days'] = preset['days']
-        context.user_data['deadline_label'] = preset['label']
+        ud['deadline_key'] = key
+        ud['deadline_days'] = preset['days']
+        ud['deadline_label'] = preset['label']
         await query.edit_message_text(
             REQUIREMENTS_PROMPT_TEXT,
-            reply_markup=build_requirements_keyboard(),
+            reply_markup=REQUIREMENTS_MARKUP,
             parse_mode=ParseMode.MARKDOWN,
             disable_web_page_preview=True,
         )
         return INPUT_REQUIREMENTS
-    elif data.startswith('type_'):
+    elif prefix == 'type':
         return await view_order_details(update, context)
     return SELECT_DEADLINE
 
@@ -1397,6 +2338,7 @@ async def ask_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return INPUT_CONTACT
 
 async def input_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ud = context.user_data
     contact_text = update.message.text.strip()
     link = build_contact_link(contact_text)
     if not link:
@@ -1406,9 +2348,9 @@ async def input_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
             disable_web_page_preview=True,
         )
         return INPUT_CONTACT
-    context.user_data['contact'] = contact_text
-    context.user_data['contact_link'] = link
-    context.user_data['pending_files'] = []
+    ud['contact'] = contact_text
+    ud['contact_link'] = link
+    ud['pending_files'] = []
     return await prompt_file_upload(update, context)
 
 async def prompt_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1418,82 +2360,55 @@ async def prompt_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE)
         "• Когда закончите, нажмите «Готово» или используйте /done.\n"
         "• Если файлов нет, нажмите «Пропустить» или используйте /skip."
     )
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ Готово", callback_data='files_done')],
-        [InlineKeyboardButton("⏭ Пропустить", callback_data='files_skip')]
-    ])
-    await update.message.reply_text(text, reply_markup=keyboard)
+    await update.message.reply_text(text, reply_markup=FILE_UPLOAD_MARKUP)
     return UPLOAD_FILES
 
+@dataclass(slots=True)
+class PendingFile:
+    """Файл, прикреплённый к заказу до подтверждения.
+
+    В user_data кладётся только словарь из to_record(): user_data сохраняется в
+    conversations.pickle, и загрузка состояния не должна зависеть от классов модуля.
+    """
+    type: str
+    file_id: str
+    file_name: Optional[str] = None
+    file_emoji: Optional[str] = None
+
+    def to_record(self) -> dict:
+        record = {'type': self.type, 'file_id': self.file_id}
+        if self.file_name is not None:
+            record['file_name'] = self.file_name
+        if self.file_emoji is not None:
+            record['file_emoji'] = self.file_emoji
+        return record
+
+
+# Порядок проверки как в прежней цепочке if/elif: у GIF Telegram заполняет и message.document
+_FILE_UPLOAD_KINDS = (
+    ('document', lambda f: PendingFile('document', f.file_id, file_name=f.file_name), "📄 Файл {} сохранен."),
+    ('photo', lambda f: PendingFile('photo', f[-1].file_id), "🖼 Фото сохранено."),
+    ('audio', lambda f: PendingFile('audio', f.file_id, file_name=f.file_name or f.title), "🎧 Аудио сохранено."),
+    ('voice', lambda f: PendingFile('voice', f.file_id), "🎙 Голосовое сообщение сохранено."),
+    ('video', lambda f: PendingFile('video', f.file_id, file_name=f.file_name), "🎬 Видео сохранено."),
+    ('video_note', lambda f: PendingFile('video_note', f.file_id), "📹 Видео-заметка сохранена."),
+    ('animation', lambda f: PendingFile('animation', f.file_id, file_name=f.file_name), "🌀 GIF сохранен."),
+    ('sticker', lambda f: PendingFile('sticker', f.file_id, file_emoji=f.emoji), "🔖 Стикер сохранен."),
+)
+
+
 async def handle_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
     files_list = context.user_data.setdefault('pending_files', [])
     message = update.message
-    acknowledgement = None
-    if message.document:
-        document = message.document
-        files_list.append({
-            'type': 'document',
-            'file_id': document.file_id,
-            'file_name': document.file_name,
-        })
-        acknowledgement = f"📄 Файл {document.file_name or 'загружен'} сохранен."
-    elif message.photo:
-        photo = message.photo[-1]
-        files_list.append({
-            'type': 'photo',
-            'file_id': photo.file_id,
-        })
-        acknowledgement = "🖼 Фото сохранено."
-    elif message.audio:
-        audio = message.audio
-        files_list.append({
-            'type': 'audio',
-            'file_id': audio.file_id,
-            'file_name': audio.file_name or audio.title,
-        })
-        acknowledgement = "🎧 Аудио сохранено."
-    elif message.voice:
-        voice = message.voice
-        files_list.append({
-            'type': 'voice',
-            'file_id': voice.file_id,
-        })
-        acknowledgement = "🎙 Голосовое сообщение сохранено."
-    elif message.video:
-        video = message.video
-        files_list.append({
-            'type': 'video',
-            'file_id': video.file_id,
-            'file_name': video.file_name,
-        })
-        acknowledgement = "🎬 Видео сохранено."
-    elif message.video_note:
-        video_note = message.video_note
-        files_list.append({
-            'type': 'video_note',
-            'file_id': video_note.file_id,
-        })
-        acknowledgement = "📹 Видео-заметка сохранена."
-    elif message.animation:
-        animation = message.animation
-        files_list.append({
-            'type': 'animation',
-            'file_id': animation.file_id,
-            'file_name': animation.file_name,
-        })
-        acknowledgement = "🌀 GIF сохранен."
-    elif message.sticker:
-        sticker = message.sticker
-        files_list.append({
-            'type': 'sticker',
-            'file_id': sticker.file_id,
-            'file_emoji': sticker.emoji,
-        })
-        acknowledgement = "🔖 Стикер сохранен."
-    if acknowledgement:
-        await message.reply_text(f"{acknowledgement} Можете прикрепить еще или нажать «Готово».")
-    else:
-        await message.reply_text("Не удалось определить файл. Попробуйте еще раз или нажмите «Готово».")
+    for attr, build, acknowledgement in _FILE_UPLOAD_KINDS:
+        attachment = getattr(message, attr)
+        if attachment:
+            pending = build(attachment)
+            files_list.append(pending.to_record())
+            acknowledgement = acknowledgement.format(pending.file_name or 'загружен')
+            await message.reply_text(f"{acknowledgement} Можете прикрепить еще или нажать «Готово».")
+            return UPLOAD_FILES
+    await message.reply_text("Не удалось определить файл. Попробуйте еще раз или нажмите «Готово».")
     return UPLOAD_FILES
 
 async def skip_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1503,12 +2418,13 @@ async def skip_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def file_upload_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    ud = context.user_data
     await answer_callback_query(query, context)
     data = query.data
     if data == 'files_skip':
-        context.user_data['pending_files'] = []
-    elif not context.user_data.get('pending_files'):
-        context.user_data['pending_files'] = []
+        ud['pending_files'] = []
+    elif not ud.get('pending_files'):
+        ud['pending_files'] = []
     return await add_upsell(update, context)
 
 async def remind_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1521,17 +2437,12 @@ async def add_upsell(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'Добавим дополнительные материалы? Клиенты, которые выбирают презентацию или речь, '
         'получают +5% скидку на следующий заказ и готовый комплект.'
     )
-    keyboard = [
-        [InlineKeyboardButton("Презентация (+2000₽)", callback_data='add_prez')],
-        [InlineKeyboardButton("Речь (+1000₽)", callback_data='add_speech')],
-        [InlineKeyboardButton("Без допов", callback_data='no_upsell')]
-    ]
     if update.message:
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        await update.message.reply_text(text, reply_markup=ADD_UPSELL_MARKUP)
     else:
         query = update.callback_query
         await answer_callback_query(query, context)
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text(text, reply_markup=ADD_UPSELL_MARKUP)
     return ADD_UPSSELL
 
 # Обработчик допуслуг
@@ -1539,22 +2450,22 @@ async def upsell_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await answer_callback_query(query, context)
     data = query.data
-    upsells = context.user_data.setdefault('upsells', set())
+    upsells = context.user_data.setdefault('upsells', dict.fromkeys(UPSELL_LABELS, False))
     added = False
     if data == 'add_prez':
-        if 'prez' not in upsells:
-            upsells.add('prez')
+        if not upsells['prez']:
+            upsells['prez'] = True
             added = True
     elif data == 'add_speech':
-        if 'speech' not in upsells:
-            upsells.add('speech')
+        if not upsells['speech']:
+            upsells['speech'] = True
             added = True
     elif data == 'no_upsell':
         return await process_order(update, context)
-    selected = [UPSELL_LABELS.get(u, u) for u in upsells]
+    selected = [UPSELL_LABELS[u] for u, chosen in upsells.items() if chosen]
     if added:
         text = 'Добавить ещё опции? Полный комплект фиксирует +5% скидку на следующий заказ.'
-    elif upsells:
+    elif selected:
         text = (
             f"Вы уже выбрали: {', '.join(selected)}.\n"
             'Скидка +5% на следующий заказ закреплена — добавить что-то ещё?'
@@ -1564,37 +2475,38 @@ async def upsell_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'Выберите дополнительные материалы — презентацию или речь. '
             'Так вы получите +5% скидку на следующий заказ и полный комплект для выступления.'
         )
-    keyboard = [
-        [InlineKeyboardButton(f"{'✅ ' if 'prez' in upsells else ''}Презентация (+2000₽)", callback_data='add_prez')],
-        [InlineKeyboardButton(f"{'✅ ' if 'speech' in upsells else ''}Речь (+1000₽)", callback_data='add_speech')],
-        [InlineKeyboardButton("Продолжить", callback_data='no_upsell')]
-    ]
     try:
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        await edit_message_if_changed(query, context, text, reply_markup=UPSELL_CHOICE_MARKUPS[upsells['prez'], upsells['speech']])
     except TelegramError as e:
-        if "message is not modified" in str(e).lower():
-            pass
+        if not is_message_not_modified(e):
+            logger.warning(f"Не удалось обновить выбор допов: {e}")
     return ADD_UPSSELL
 
 async def process_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    type_key = context.user_data.get('current_order_type')
+    ud = context.user_data
+    type_key = ud.get('current_order_type')
     if not type_key or type_key not in ORDER_TYPES:
         await query.edit_message_text("Ошибка: неверный тип заказа.")
         return ConversationHandler.END
-    topic = context.user_data.get('topic', 'Без темы')
-    deadline_key = context.user_data.get('deadline_key', DEFAULT_DEADLINE_KEY)
+    topic = ud.get('topic', 'Без темы')
+    deadline_key = ud.get('deadline_key', DEFAULT_DEADLINE_KEY)
     preset = get_deadline_preset(deadline_key)
     deadline_days = preset['days']
-    deadline_label = context.user_data.get('deadline_label', preset['label'])
-    requirements = context.user_data.get('requirements', 'Нет')
-    contact = context.user_data.get('contact', '')
-    contact_link = context.user_data.get('contact_link')
-    files = list(context.user_data.get('pending_files', []))
-    upsells = list(context.user_data.get('upsells', set()))
+    deadline_label = ud.get('deadline_label', preset['label'])
+    requirements = ud.get('requirements', 'Нет')
+    contact = ud.get('contact', '')
+    contact_link = ud.get('contact_link')
+    # Забираем данные из user_data без копирования — они переходят в заказ
+    # PendingFile может остаться в conversations.pickle, записанном до перехода на словари
+    files = [
+        item.to_record() if isinstance(item, PendingFile) else item
+        for item in ud.pop('pending_files', None) or ()
+    ]
+    upsell_flags = ud.pop('upsells', None) or {}
+    upsells = [u for u, chosen in upsell_flags.items() if chosen]
     price = calculate_price(type_key, deadline_key)
-    extra = sum(UPSELL_PRICES.get(u, 0) for u in upsells)
-    price += extra
+    price += UPSELL_PRICE_BY_SET[frozenset(upsells)]
     order = {
         'type': type_key,
         'topic': topic,
@@ -1609,38 +2521,30 @@ async def process_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'contact_link': contact_link,
         'files': files,
     }
-    context.user_data.setdefault('cart', []).append(order)
-    context.user_data.pop('upsells', None)
-    context.user_data.pop('requirements', None)
-    context.user_data.pop('deadline_key', None)
-    context.user_data.pop('deadline_days', None)
-    context.user_data.pop('deadline_label', None)
-    context.user_data.pop('topic', None)
-    context.user_data.pop('current_order_type', None)
-    context.user_data.pop('contact', None)
-    context.user_data.pop('contact_link', None)
-    context.user_data.pop('pending_files', None)
+    cart = ud.setdefault('cart', [])
+    # Сумма корзины копится по мере добавления заказов, чтобы confirm_cart не пересчитывал её
+    cart_total = ud.get('cart_total')
+    if cart_total is None:
+        cart_total = sum(item['price'] for item in cart)
+    cart.append(order)
+    ud['cart_total'] = cart_total + price
+    for key in ORDER_DRAFT_KEYS:
+        ud.pop(key, None)
     return await add_another_order(update, context)
 
 # Добавить еще заказ
 async def add_another_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     text = "Добавить еще заказ? (Несколько заказов = 10% скидка!)"
-    keyboard = [
-        [InlineKeyboardButton("Да", callback_data='add_another_yes')],
-        [InlineKeyboardButton("Нет, оформить", callback_data='confirm_cart')]
-    ]
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    await query.edit_message_text(text, reply_markup=ADD_ANOTHER_MARKUP)
     return ADD_ANOTHER_ORDER
 
 async def add_another_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await answer_callback_query(query, context)
-    data = query.data
-    if data == 'add_another_yes':
-        return await select_order_type(update, context)
-    elif data == 'confirm_cart':
-        return await confirm_cart(update, context)
+    handler = ADD_ANOTHER_ROUTES.get(query.data)
+    if handler:
+        return await handler(update, context)
     return ADD_ANOTHER_ORDER
 
 # Подтверждение корзины
@@ -1650,114 +2554,215 @@ async def confirm_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not cart:
         await query.edit_message_text("Корзина пуста.")
         return await main_menu(update, context)
-    text_lines = ["<b>Ваша корзина. Подтвердите — зафиксируем персональный бонус:</b>"]
-    total = 0
+    escape = html.escape
+    text_lines = [CART_HEADER_HTML]
+    total = context.user_data.get('cart_total')
+    if total is None:
+        total = sum(order['price'] for order in cart)
     for i, order in enumerate(cart, 1):
-        order_name = ORDER_TYPES.get(order['type'], {}).get('name', 'Неизвестно')
-        contact_display = order.get('contact', 'Не указан')
-        deadline_display = order.get('deadline_label') or f"{order.get('deadline_days', 0)} дней"
-        contact_link = order.get('contact_link')
-        if contact_link:
-            contact_html = f"<a href=\"{html.escape(contact_link, quote=True)}\">{html.escape(contact_display)}</a>"
-        else:
-            contact_html = html.escape(contact_display)
-        upsell_titles = [UPSELL_LABELS.get(u, u) for u in order.get('upsells', [])]
-        if upsell_titles:
-            upsell_html = html.escape(', '.join(upsell_titles))
-        else:
-            upsell_html = 'нет'
-        text_lines.extend([
-            f"{i}. <b>{html.escape(order_name)}</b> — {html.escape(order.get('topic', 'Без темы'))} — {order['price']} ₽",
-            f"• Срок: {html.escape(deadline_display)}",
-            f"• Контакт: {contact_html}",
-            f"• Допы: {upsell_html}",
-        ])
+        text_lines.append(CART_ORDER_TEMPLATE.format(
+            index=i,
+            name=ORDER_NAME_HTML.get(order['type'], 'Неизвестно'),
+            topic=escape(order.get('topic', 'Без темы')),
+            price=order['price'],
+            deadline=escape(order_deadline_display(order, 0)),
+            contact=order_contact_html(order),
+            upsells=upsell_summary_html(order.get('upsells')),
+        ))
         if order.get('files'):
             text_lines.append(f"• Файлы: {len(order['files'])} шт.")
-        total += order['price']
     if len(cart) > 1:
         discount = round_price(total * 0.1)
         total -= discount
         text_lines.append(f"Скидка за несколько заказов: -{discount} ₽")
-    text_lines.append(f"<b>Итого: {total} ₽</b> — сумма с учётом допов и скидок.")
-    text_lines.append(
-        'После подтверждения наш менеджер свяжется с вами для финального согласования '
-        'и ответит на любые вопросы.'
-    )
-    text_lines.append("Подтвердить оформление?")
+    text_lines.append(CART_FOOTER_TEMPLATE.format(total=total))
     text = "\n".join(text_lines)
-    keyboard = [
-        [InlineKeyboardButton("Подтвердить", callback_data='place_order')],
-        [InlineKeyboardButton("Отменить", callback_data='cancel_cart')]
-    ]
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    await query.edit_message_text(text, reply_markup=CONFIRM_CART_MARKUP, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
     return CONFIRM_CART
 
 async def confirm_cart_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await answer_callback_query(query, context)
-    data = query.data
-    if data == 'place_order':
-        user = update.effective_user
-        user_id = str(user.id)
-        user_orders = ORDERS.setdefault(user_id, [])
-        existing_ids = [order.get('order_id', 0) for order in user_orders]
-        order_id = max(existing_ids, default=0) + 1
-        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        new_orders = []
-        for raw_order in context.user_data['cart']:
-            order_data = dict(raw_order)
-            order_data['order_id'] = order_id
-            order_data['user_id'] = int(user_id)
-            order_data['created_at'] = created_at
-            order_data['updated_at'] = created_at
-            status_code = DEFAULT_ORDER_STATUS
-            order_data['status_code'] = status_code
-            order_data['status'] = get_status_label(status_code)
-            order_data['status_history'] = [{
-                'code': status_code,
-                'status': get_status_label(status_code),
-                'timestamp': created_at,
-                'note': 'Заказ создан клиентом',
-            }]
-            order_data['bonus_used'] = 0
-            order_data['referral_rewarded'] = False
-            order_data['loyalty_rewarded'] = False
-            referrer_id = get_referrer_for_user(int(user_id))
-            if referrer_id:
-                order_data['referrer_id'] = referrer_id
-                update_referral_entry(
-                    referrer_id,
-                    int(user_id),
-                    add_order=order_id,
-                    status='оформил заказ',
-                )
-                save_json(REFERRALS_FILE, REFERALS)
-            user_orders.append(order_data)
-            new_orders.append(order_data)
-            order_id += 1
-        save_json(ORDERS_FILE, ORDERS)
-        text = (
-            "✅ Заказ оформлен! Наш менеджер скоро свяжется с вами.\n"
-            "[Администратор](https://t.me/Thisissaymoon) уже получил все детали и файлы."
-        )
-        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN)
-        if ADMIN_CHAT_ID:
-            await notify_admin_about_order(update, context, new_orders)
-        context.user_data.pop('cart', None)
-        return await main_menu(
-            update,
-            context,
-            "Спасибо! Хотите заказать ещё? Наш менеджер уже на связи — [администратор](https://t.me/Thisissaymoon).",
-        )
-    elif data == 'cancel_cart':
-        context.user_data.pop('cart', None)
-        return await main_menu(update, context, "Корзина отменена. Посмотрите еще?")
+    handler = CONFIRM_CART_ROUTES.get(query.data)
+    if handler:
+        return await handler(update, context)
     return CONFIRM_CART
 
-async def notify_admin_about_order(update: Update, context: ContextTypes.DEFAULT_TYPE, orders):
-    if not ADMIN_CHAT_ID:
+
+@debounce_clicks
+async def place_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    cart = context.user_data.get('cart')
+    if not cart:
+        # Корзину уже оформило предыдущее нажатие — повторно заказы не создаём
+        return await main_menu(update, context)
+    user = update.effective_user
+    user_id = str(user.id)
+    user_orders = ORDERS.setdefault(user_id, [])
+    order_id = NEXT_ORDER_ID.get(user_id, 1)
+    now = datetime.now()
+    created_at = now.isoformat(' ', 'seconds')
+    created_at_ms = datetime_to_ms(now)
+    new_orders = []
+    referrals_changed = False
+    for raw_order in cart:
+        order_data = dict(raw_order)
+        order_data['order_id'] = order_id
+        order_data['user_id'] = int(user_id)
+        order_data['created_at'] = created_at
+        order_data['created_at_ms'] = created_at_ms
+        order_data['updated_at'] = created_at
+        status_code = DEFAULT_ORDER_STATUS
+        order_data['status_code'] = status_code
+        order_data['status'] = get_status_label(status_code)
+        order_data['status_history'] = [{
+            'code': status_code,
+            'status': get_status_label(status_code),
+            'timestamp': created_at,
+            'note': 'Заказ создан клиентом',
+        }]
+        order_data['bonus_used'] = 0
+        order_data['referral_rewarded'] = False
+        order_data['loyalty_rewarded'] = False
+        referrer_id = get_referrer_for_user(int(user_id))
+        if referrer_id:
+            order_data['referrer_id'] = referrer_id
+            update_referral_entry(
+                referrer_id,
+                int(user_id),
+                add_order=order_id,
+                status='оформил заказ',
+            )
+            referrals_changed = True
+        user_orders.append(order_data)
+        register_order(user_id, order_data)
+        new_orders.append(order_data)
+        order_id += 1
+    # Новые заказы дописываются в журнал, а не перезаписывают весь файл; снимок соберёт compact_order_log
+    if not all([append_order_log(user_id, order) for order in new_orders]):
+        schedule_save(ORDERS_FILE, ORDERS)
+    if referrals_changed:
+        schedule_save(REFERRALS_FILE, REFERALS)
+    text = (
+        "✅ Заказ оформлен! Наш менеджер скоро свяжется с вами.\n"
+        "[Администратор](https://t.me/Thisissaymoon) уже получил все детали и файлы."
+    )
+    await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN)
+    await notify_admin_about_order(update, context, new_orders)
+    clear_cart(context.user_data)
+    return await main_menu(
+        update,
+        context,
+        "Спасибо! Хотите заказать ещё? Наш менеджер уже на связи — [администратор](https://t.me/Thisissaymoon).",
+    )
+
+
+def clear_cart(ud: dict) -> None:
+    ud.pop('cart', None)
+    ud.pop('cart_total', None)
+
+
+async def cancel_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    clear_cart(context.user_data)
+    return await main_menu(update, context, "Корзина отменена. Посмотрите еще?")
+
+# Очередь уведомлений администратору: заказы не ждут отправки в Telegram,
+# а близкие по времени сообщения склеиваются в одну сводку
+ADMIN_NOTIFY_FLUSH_INTERVAL = 0.5
+ADMIN_SEND_INTERVAL = 1 / 30
+ADMIN_MESSAGE_LIMIT = 4096
+ADMIN_SEND_RETRIES = 3
+_admin_queue: Optional[asyncio.Queue] = None
+_admin_worker_task: Optional[asyncio.Task] = None
+
+
+def enqueue_admin_notification(kind: str, payload) -> None:
+    if _admin_queue is None:
+        logger.warning("Очередь уведомлений администратора не запущена, уведомление пропущено.")
+        return
+    _admin_queue.put_nowait((kind, payload))
+
+
+def split_admin_digest(texts: list) -> list:
+    chunks = []
+    current = ''
+    for text in texts:
+        candidate = f"{current}\n\n{text}" if current else text
+        if current and len(candidate) > ADMIN_MESSAGE_LIMIT:
+            chunks.append(current)
+            current = text
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def deliver_admin_batch(bot, batch: list) -> None:
+    texts = [payload for kind, payload in batch if kind == 'text']
+    for chunk in split_admin_digest(texts):
+        for _ in range(ADMIN_SEND_RETRIES):
+            try:
+                await bot.send_message(ADMIN_CHAT_ID, chunk, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            except RetryAfter as e:
+                # Telegram просит подождать: выдерживаем паузу и повторяем ту же сводку
+                logger.warning(f"Флуд-контроль при уведомлении администратора, пауза {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+                continue
+            except TelegramError as e:
+                logger.warning(f"Не удалось отправить уведомление администратору: {e}")
+            break
+        else:
+            logger.warning("Уведомление администратору не отправлено: Telegram продолжает ограничивать частоту.")
+        await asyncio.sleep(ADMIN_SEND_INTERVAL)
+    for kind, payload in batch:
+        if kind == 'files':
+            await send_order_files(bot, payload)
+
+
+async def admin_notification_worker(bot) -> None:
+    # None в очереди — сигнал остановки: уже взятая сводка доставляется, и только потом воркер выходит
+    stopping = False
+    while not stopping:
+        batch = [await _admin_queue.get()]
+        if batch[0] is not None:
+            await asyncio.sleep(ADMIN_NOTIFY_FLUSH_INTERVAL)
+        while not _admin_queue.empty():
+            batch.append(_admin_queue.get_nowait())
+        if None in batch:
+            stopping = True
+            batch = [item for item in batch if item is not None]
+        if not batch:
+            continue
+        try:
+            await deliver_admin_batch(bot, batch)
+        except Exception as e:
+            logger.error(f"Ошибка в очереди уведомлений администратора: {e}")
+
+
+async def start_admin_notifications(application) -> None:
+    global _admin_queue, _admin_worker_task
+    _admin_queue = asyncio.Queue()
+    _admin_worker_task = asyncio.create_task(admin_notification_worker(application.bot))
+
+
+async def stop_admin_notifications(application) -> None:
+    global _admin_worker_task
+    if _admin_queue is None:
         return
+    if _admin_worker_task is not None:
+        # Не отменяем воркер: отмена потеряла бы сводку, которую он уже забрал из очереди
+        _admin_queue.put_nowait(None)
+        await _admin_worker_task
+        _admin_worker_task = None
+    batch = []
+    while not _admin_queue.empty():
+        batch.append(_admin_queue.get_nowait())
+    if batch:
+        await deliver_admin_batch(application.bot, batch)
+
+
+async def notify_admin_about_order(update: Update, context: ContextTypes.DEFAULT_TYPE, orders):
     user = update.effective_user
     user_id = str(user.id)
     user_link = get_user_link(user)
@@ -1765,94 +2770,141 @@ async def notify_admin_about_order(update: Update, context: ContextTypes.DEFAULT
     header = f"🆕 Новый заказ от <a href=\"{html.escape(user_link, quote=True)}\">{user_name}</a> (ID: {user_id})"
     blocks = []
     for order in orders:
-        order_name = ORDER_TYPES.get(order.get('type'), {}).get('name', 'Неизвестно')
-        contact_display = order.get('contact', 'Не указан')
-        contact_link = order.get('contact_link')
-        if contact_link:
-            contact_html = f"<a href=\"{html.escape(contact_link, quote=True)}\">{html.escape(contact_display)}</a>"
-        else:
-            contact_html = html.escape(contact_display)
-        upsell_titles = [UPSELL_LABELS.get(u, u) for u in order.get('upsells', [])]
-        upsell_text = ', '.join(upsell_titles) if upsell_titles else 'нет'
-        deadline_display = order.get('deadline_label') or f"{order.get('deadline_days', 0)} дней"
         block = (
-            f"#{order.get('order_id', 'N/A')} — {html.escape(order_name)}\n"
+            f"#{order.get('order_id', 'N/A')} — {ORDER_NAME_HTML.get(order.get('type'), 'Неизвестно')}\n"
             f"Тема: {html.escape(order.get('topic', 'Без темы'))}\n"
-            f"Срок: {html.escape(deadline_display)}\n"
-            f"Контакт клиента: {contact_html}\n"
-            f"Допы: {html.escape(upsell_text)}\n"
+            f"Срок: {html.escape(order_deadline_display(order, 0))}\n"
+            f"Контакт клиента: {order_contact_html(order)}\n"
+            f"Допы: {upsell_summary_html(order.get('upsells'))}\n"
             f"Требования: {html.escape(order.get('requirements', 'Нет'))}\n"
             f"Сумма: {order.get('price', 0)} ₽"
         )
         if order.get('files'):
             block += f"\nФайлы: {len(order['files'])} шт."
         blocks.append(block)
-    message = header + "\n\n" + "\n\n".join(blocks)
-    await context.bot.send_message(ADMIN_CHAT_ID, message, parse_mode=ParseMode.HTML)
+    enqueue_admin_notification('text', header + "\n\n" + "\n\n".join(blocks))
+    if any(order.get('files') for order in orders):
+        enqueue_admin_notification('files', orders)
+
+
+MEDIA_GROUP_LIMIT = 10
+# Сколько заказов одновременно отправляют файлы администратору; общий темп держит AIORateLimiter
+ADMIN_FILE_SEND_CONCURRENCY = 5
+
+
+async def send_admin_file(bot, send, order_id, follow_up: Optional[str] = None) -> None:
+    # Альбом или файл; подпись к кружку и стикеру уходит следом за ним, а не параллельно
+    try:
+        await send
+        if follow_up:
+            await bot.send_message(ADMIN_CHAT_ID, follow_up)
+    except TelegramError as e:
+        logger.warning(f"Не удалось отправить файлы заказа #{order_id} администратору: {e}")
+
+
+async def send_admin_files_in_order(bot, order_id, sends: list) -> None:
+    # Файлы одного заказа уходят строго по очереди, чтобы в чате администратора не перемешались
+    for send, follow_up in sends:
+        await send_admin_file(bot, send, order_id, follow_up)
+
+
+async def gather_limited(coros, limit: int) -> None:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            await coro
+
+    await asyncio.gather(*(run(coro) for coro in coros))
+
+
+def media_batch_sends(bot, media_items: list) -> list:
+    # Альбом в Telegram — от 2 до 10 элементов; одиночный файл отправляем обычным методом
+    sends = []
+    for i in range(0, len(media_items), MEDIA_GROUP_LIMIT):
+        chunk = media_items[i:i + MEDIA_GROUP_LIMIT]
+        if len(chunk) > 1:
+            sends.append(bot.send_media_group(ADMIN_CHAT_ID, chunk))
+        elif isinstance(chunk[0], InputMediaPhoto):
+            sends.append(bot.send_photo(ADMIN_CHAT_ID, chunk[0].media, caption=chunk[0].caption))
+        elif isinstance(chunk[0], InputMediaVideo):
+            sends.append(bot.send_video(ADMIN_CHAT_ID, chunk[0].media, caption=chunk[0].caption))
+        elif isinstance(chunk[0], InputMediaAudio):
+            sends.append(bot.send_audio(ADMIN_CHAT_ID, chunk[0].media, caption=chunk[0].caption))
+        else:
+            sends.append(bot.send_document(ADMIN_CHAT_ID, chunk[0].media, caption=chunk[0].caption))
+    return sends
+
+
+async def send_order_files(bot, orders) -> None:
+    jobs = []
     for order in orders:
-        order_name = ORDER_TYPES.get(order.get('type'), {}).get('name', 'Неизвестно')
+        order_id = order.get('order_id')
+        sends = []
+        order_name = ORDER_TYPE_NAMES.get(order.get('type'), 'Неизвестно')
         caption_base = f"Файлы для заказа #{order.get('order_id', 'N/A')} — {order_name}"
+        # Альбомы в Telegram однородны: документы и аудио — отдельно, фото и видео можно смешивать
+        documents = []
+        visual = []
+        audios = []
         for file_info in order.get('files', []):
             file_type = file_info.get('type')
             file_id = file_info.get('file_id')
             if not file_id:
                 continue
+            caption = caption_base
+            if file_info.get('file_name'):
+                caption += f"\n{file_info['file_name']}"
             if file_type == 'document':
-                caption = caption_base
-                if file_info.get('file_name'):
-                    caption += f"\n{file_info['file_name']}"
-                await context.bot.send_document(ADMIN_CHAT_ID, file_id, caption=caption)
+                documents.append(InputMediaDocument(file_id, caption=caption))
             elif file_type == 'photo':
-                await context.bot.send_photo(ADMIN_CHAT_ID, file_id, caption=caption_base)
+                visual.append(InputMediaPhoto(file_id, caption=caption_base))
+            elif file_type == 'video':
+                visual.append(InputMediaVideo(file_id, caption=caption))
             elif file_type == 'audio':
-                caption = caption_base
-                if file_info.get('file_name'):
-                    caption += f"\n{file_info['file_name']}"
-                await context.bot.send_audio(ADMIN_CHAT_ID, file_id, caption=caption)
+                audios.append(InputMediaAudio(file_id, caption=caption))
             elif file_type == 'voice':
-                await context.bot.send_voice(ADMIN_CHAT_ID, file_id, caption=caption_base)
-            elif file_type == 'video':
-                caption = caption_base
-                if file_info.get('file_name'):
-                    caption += f"\n{file_info['file_name']}"
-                await context.bot.send_video(ADMIN_CHAT_ID, file_id, caption=caption)
+                sends.append((bot.send_voice(ADMIN_CHAT_ID, file_id, caption=caption_base), None))
             elif file_type == 'video_note':
-                await context.bot.send_video_note(ADMIN_CHAT_ID, file_id)
-                await context.bot.send_message(ADMIN_CHAT_ID, caption_base)
+                sends.append((bot.send_video_note(ADMIN_CHAT_ID, file_id), caption_base))
             elif file_type == 'animation':
-                caption = caption_base
-                if file_info.get('file_name'):
-                    caption += f"\n{file_info['file_name']}"
-                await context.bot.send_animation(ADMIN_CHAT_ID, file_id, caption=caption)
+                sends.append((bot.send_animation(ADMIN_CHAT_ID, file_id, caption=caption), None))
             elif file_type == 'sticker':
-                await context.bot.send_sticker(ADMIN_CHAT_ID, file_id)
-                await context.bot.send_message(ADMIN_CHAT_ID, caption_base)
+                sends.append((bot.send_sticker(ADMIN_CHAT_ID, file_id), caption_base))
+        for media_items in (documents, visual, audios):
+            sends.extend((send, None) for send in media_batch_sends(bot, media_items))
+        if sends:
+            jobs.append(send_admin_files_in_order(bot, order_id, sends))
+    # Разные заказы независимы: их файлы идут параллельно, но не больше ADMIN_FILE_SEND_CONCURRENCY заказов сразу
+    await gather_limited(jobs, ADMIN_FILE_SEND_CONCURRENCY)
 
 
 async def notify_admin_order_event(context: ContextTypes.DEFAULT_TYPE, user, order: dict, action: str, extra_note: Optional[str] = None):
-    if not ADMIN_CHAT_ID:
-        return
     user_link = get_user_link(user)
     user_name = html.escape(user.full_name or user.first_name or str(user.id))
     order_id = html.escape(str(order.get('order_id', 'N/A')))
-    order_name = html.escape(ORDER_TYPES.get(order.get('type'), {}).get('name', 'Неизвестный тип'))
+    order_name = ORDER_NAME_HTML.get(order.get('type'), 'Неизвестный тип')
     status_html = html.escape(build_order_status(order))
-    deadline_display = order.get('deadline_label') or f"{order.get('deadline_days', '—')} дней"
-    contact_display = order.get('contact', 'Не указан')
-    contact_link = order.get('contact_link')
-    if contact_link:
-        contact_html = f"<a href=\"{html.escape(contact_link, quote=True)}\">{html.escape(contact_display)}</a>"
-    else:
-        contact_html = html.escape(contact_display)
     lines = [
         f"ℹ️ Клиент <a href=\"{html.escape(user_link, quote=True)}\">{user_name}</a> {html.escape(action)} заказ #{order_id} — {order_name}.",
         f"Статус: {status_html}.",
-        f"Срок: {html.escape(deadline_display)}",
-        f"Контакт клиента: {contact_html}",
+        f"Срок: {html.escape(order_deadline_display(order))}",
+        f"Контакт клиента: {order_contact_html(order)}",
     ]
     if extra_note:
         lines.append(html.escape(extra_note))
-    await context.bot.send_message(ADMIN_CHAT_ID, "\n".join(lines), parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    enqueue_admin_notification('text', "\n".join(lines))
+
+
+async def _notify_admin_disabled(*args, **kwargs):
+    return None
+
+
+# Без ADMIN_CHAT_ID уведомления подменяются заглушкой один раз при импорте,
+# поэтому ни сами функции, ни места вызова ADMIN_CHAT_ID не проверяют
+if not ADMIN_CHAT_ID:
+    notify_admin_about_order = _notify_admin_disabled
+    notify_admin_order_event = _notify_admin_disabled
 
 
 # Показ прайс-листа
@@ -1869,25 +2921,14 @@ async def show_price_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
         prices = PRICES.get(key, {})
         min_price = prices.get('min') or prices.get('base')
         rush_price = calculate_price(key, '24h') if prices else None
-        text_lines = [
-            f"{val.get('icon', '')} *{val.get('name', '')}*",
-            "",
-            val.get('description', ''),
-            val.get('details', ''),
-            f"Примеры: {', '.join(val.get('examples', []))}",
-        ]
+        text_lines = [PRICE_DETAIL_TEXT[key]]
         if min_price:
             text_lines.append(f"Минимальная стоимость: {min_price} ₽")
         if rush_price and rush_price != min_price:
             text_lines.append(f"Срочный заказ (24 часа или меньше): {rush_price} ₽")
         text_lines.append("\nЗакажите со скидкой!")
         text = "\n".join(filter(None, text_lines))
-        keyboard = [
-            [InlineKeyboardButton("Рассчитать", callback_data='price_calculator')],
-            [InlineKeyboardButton("Заказать", callback_data=f'type_{key}')],
-            [InlineKeyboardButton("Назад", callback_data='price_list')]
-        ]
-        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=PRICE_DETAIL_MARKUPS[key])
         return SHOW_PRICE_LIST
     elif data.startswith('type_'):
         return await view_order_details(update, context)
@@ -1897,15 +2938,13 @@ async def show_price_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await main_menu(update, context)
     user = update.effective_user
     log_user_action(user.id, user.username, "Прайс-лист", user.full_name)
-    text = "💲 Прайс-лист (10% скидка сегодня! 🔥):\n\n"
+    parts = [PRICE_LIST_HEADER]
     for key, val in ORDER_TYPES.items():
         prices = PRICES.get(key, {})
         min_price = prices.get('min') or prices.get('base', 0)
-        text += f"{val['icon']} *{val['name']}* — от {min_price} ₽\n"
-    keyboard = [[InlineKeyboardButton(f"Подробности {val['name']}", callback_data=f'price_detail_{key}')] for key, val in ORDER_TYPES.items()]
-    keyboard.append([InlineKeyboardButton("🧮 Рассчитать цену", callback_data='price_calculator')])
-    keyboard.append([InlineKeyboardButton("⬅️ Меню", callback_data='back_to_main')])
-    await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
+        parts.append(f"{val['icon']} *{val['name']}* — от {min_price} ₽\n")
+    text = "".join(parts)
+    await edit_message_if_changed(query, context, text, reply_markup=PRICE_LIST_MARKUP, parse_mode=ParseMode.MARKDOWN)
     return SHOW_PRICE_LIST
 
 # Калькулятор цен
@@ -1919,76 +2958,61 @@ async def price_calculator(update: Update, context: ContextTypes.DEFAULT_TYPE):
         key = data[10:]
         context.user_data['calc_type'] = key
         descriptions = [
-            f"Тип: {ORDER_TYPES.get(key, {}).get('name', 'Неизвестно')}",
+            f"Тип: {ORDER_TYPE_NAMES.get(key, 'Неизвестно')}",
             "Выберите срок — спокойные сроки дают бонусы:",
             "",
         ]
         for preset in DEADLINE_PRESETS:
             descriptions.append(f"{preset['label']} — {preset['badge']}")
-        reply_markup = build_deadline_keyboard('calc_dead_', include_back=True, back_callback='price_calculator')
-        await query.edit_message_text("\n".join(descriptions), reply_markup=reply_markup)
+        await edit_message_if_changed(query, context, "\n".join(descriptions), reply_markup=CALC_DEADLINE_MARKUP)
         return SELECT_CALC_DEADLINE
     elif data == 'back_to_main':
         return await main_menu(update, context)
     user = update.effective_user
     log_user_action(user.id, user.username, "Калькулятор", user.full_name)
     text = "🧮 Выберите тип:"
-    keyboard = [[InlineKeyboardButton(f"{v['icon']} {v['name']}", callback_data=f'calc_type_{k}')] for k, v in ORDER_TYPES.items()]
-    keyboard.append([InlineKeyboardButton("⬅️ Меню", callback_data='back_to_main')])
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    await edit_message_if_changed(query, context, text, reply_markup=CALC_TYPE_MARKUP)
     return PRICE_CALCULATOR
 
 async def calc_select_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    ud = context.user_data
     await answer_callback_query(query, context)
     data = query.data
     if data.startswith('calc_dead_'):
         key = data[10:]
         preset = get_deadline_preset(key)
-        context.user_data['calc_deadline_key'] = key
+        ud['calc_deadline_key'] = key
         text = f"Срок: {preset['label']}\n{preset['badge']}\n\nВыберите сложность:"
-        calc_type = context.user_data.get('calc_type')
-        back_target = f'calc_type_{calc_type}' if calc_type else 'price_calculator'
-        keyboard = [
-            [InlineKeyboardButton("Простая (базовая)", callback_data='calc_comp_1.0')],
-            [InlineKeyboardButton("Средняя (+10%)", callback_data='calc_comp_1.1'), InlineKeyboardButton("Сложная (+30%)", callback_data='calc_comp_1.3')],
-            [InlineKeyboardButton("Назад", callback_data=back_target)]
-        ]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        reply_markup = COMPLEXITY_KB_BY_TYPE.get(ud.get('calc_type'), COMPLEXITY_KB_DEFAULT)
+        await query.edit_message_text(text, reply_markup=reply_markup)
         return SELECT_CALC_COMPLEXITY
     return SELECT_CALC_DEADLINE
 
 async def calc_select_complexity(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    ud = context.user_data
     await answer_callback_query(query, context)
     data = query.data
     if data.startswith('calc_comp_'):
         comp_key = data[10:]
         comp = float(comp_key)
-        key = context.user_data.get('calc_type')
+        key = ud.get('calc_type')
         if not key:
             return await price_calculator(update, context)
-        deadline_key = context.user_data.get('calc_deadline_key', DEFAULT_DEADLINE_KEY)
+        deadline_key = ud.get('calc_deadline_key', DEFAULT_DEADLINE_KEY)
         preset = get_deadline_preset(deadline_key)
         price = calculate_price(key, deadline_key, comp)
-        name = ORDER_TYPES.get(key, {}).get('name', 'Неизвестно')
-        complexity_labels = {
-            '1.0': 'Простая (базовая)',
-            '1.1': 'Средняя (+10%)',
-            '1.3': 'Сложная (+30%)',
-        }
-        complexity_text = complexity_labels.get(comp_key, f"{int((comp - 1) * 100)}%")
+        name = ORDER_TYPE_NAMES.get(key, 'Неизвестно')
+        complexity_text = CALC_COMPLEXITY_LABELS.get(comp_key, f"{int((comp - 1) * 100)}%")
         text = (
             f"Расчет: {name}\n"
             f"Срок: {preset['label']}\n"
             f"Сложность: {complexity_text}\n"
             f"Цена: {price} ₽ (Скидка сегодня!)\n\nЗаказать?"
         )
-        keyboard = [
-            [InlineKeyboardButton("📝 Заказать", callback_data=f'type_{key}')],
-            [InlineKeyboardButton("Пересчитать", callback_data='price_calculator'), InlineKeyboardButton("Меню", callback_data='back_to_main')]
-        ]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        reply_markup = CALC_RESULT_MARKUPS.get(key) or build_calc_result_markup(key)
+        await query.edit_message_text(text, reply_markup=reply_markup)
         return PRICE_CALCULATOR
     return SELECT_CALC_COMPLEXITY
 
@@ -2003,33 +3027,14 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if data == 'profile':
             log_user_action(user.id, user.username, "Профиль", user.full_name)
         return await render_profile_main(update, context)
-    if data == 'profile_back' or data == 'back_to_main':
-        return await main_menu(update, context)
-    if data == 'profile_orders':
-        return await profile_show_orders(update, context)
-    if data and data.startswith('profile_order_pause_'):
-        order_id = data.rsplit('_', 1)[-1]
-        return await profile_toggle_order_pause(update, context, order_id)
-    if data and data.startswith('profile_order_delete_'):
-        order_id = data.rsplit('_', 1)[-1]
-        return await profile_delete_order(update, context, order_id)
-    if data and data.startswith('profile_order_remind_'):
-        order_id = data.rsplit('_', 1)[-1]
-        return await profile_remind_order(update, context, order_id)
-    if data and data.startswith('profile_order_'):
-        order_id = data.rsplit('_', 1)[-1]
-        return await profile_show_order_detail(update, context, order_id)
-    if data == 'profile_feedbacks':
-        return await profile_show_feedbacks(update, context)
-    if data == 'profile_feedback_add':
-        return await profile_prompt_feedback(update, context)
-    if data and data.startswith('profile_feedback_delete_'):
-        index_key = data.rsplit('_', 1)[-1]
-        return await profile_delete_feedback(update, context, index_key)
-    if data == 'profile_referrals':
-        return await profile_show_referrals(update, context)
-    if data == 'profile_bonuses':
-        return await profile_show_bonuses(update, context)
+    handler = PROFILE_ROUTES.get(data)
+    if handler:
+        return await handler(update, context)
+    # Разбираем callback один раз: «profile_order_pause_7» → ('profile_order_pause', '7')
+    prefix, _, tail = data.rpartition('_')
+    handler = PROFILE_TARGET_ROUTES.get(prefix)
+    if handler:
+        return await handler(update, context, tail)
     return await render_profile_main(update, context)
 
 # Показ заказов
@@ -2047,8 +3052,7 @@ async def render_profile_main(update: Update, context: ContextTypes.DEFAULT_TYPE
     credited, redeemed, balance, _ = get_bonus_summary(user_id)
     ref_link = context.user_data.get('ref_link')
     if not ref_link:
-        bot_username = (await context.bot.get_me()).username
-        ref_link = f"https://t.me/{bot_username}?start={user_id}"
+        ref_link = build_ref_link(context, user_id)
         context.user_data['ref_link'] = ref_link
     lines = [f"👤 <b>{html.escape(user.full_name or user.first_name or 'Профиль')}</b>"]
     if notice:
@@ -2062,13 +3066,7 @@ async def render_profile_main(update: Update, context: ContextTypes.DEFAULT_TYPE
         "Приглашайте друзей и копите бонусы за их заказы!",
         f"Реферальная ссылка: <a href=\"{html.escape(ref_link, quote=True)}\">{html.escape(ref_link)}</a>",
     ])
-    keyboard = [
-        [InlineKeyboardButton("📦 Мои заказы", callback_data='profile_orders')],
-        [InlineKeyboardButton("⭐ Отзывы", callback_data='profile_feedbacks')],
-        [InlineKeyboardButton("👥 Рефералы", callback_data='profile_referrals'), InlineKeyboardButton("🎁 Бонусы", callback_data='profile_bonuses')],
-        [InlineKeyboardButton("⬅️ Меню", callback_data='back_to_main')],
-    ]
-    await edit_or_send(update, context, "\n".join(lines), keyboard)
+    await edit_or_send(update, context, "\n".join(lines), PROFILE_MENU_MARKUP)
     return PROFILE_MENU
 
 
@@ -2076,7 +3074,7 @@ async def profile_show_orders(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
     user_id = str(user.id)
     log_user_action(user.id, user.username, "Профиль: список заказов", user.full_name)
-    orders = sorted(ORDERS.get(user_id, []), key=lambda o: o.get('order_id', 0))
+    orders = ORDERS.get(user_id, [])
     lines = ["📦 <b>Ваши заказы</b>"]
     if notice:
         lines.append(f"<i>{html.escape(notice)}</i>")
@@ -2085,7 +3083,7 @@ async def profile_show_orders(update: Update, context: ContextTypes.DEFAULT_TYPE
     else:
         for order in orders:
             order_id = order.get('order_id', '—')
-            order_name = ORDER_TYPES.get(order.get('type'), {}).get('name', 'Неизвестный тип')
+            order_name = ORDER_TYPE_NAMES.get(order.get('type'), 'Неизвестный тип')
             status = build_order_status(order)
             lines.append(
                 f"• #{html.escape(str(order_id))} — {html.escape(order_name)} ({html.escape(status)})"
@@ -2095,11 +3093,11 @@ async def profile_show_orders(update: Update, context: ContextTypes.DEFAULT_TYPE
         order_id = order.get('order_id')
         if order_id is None:
             continue
-        order_name = ORDER_TYPES.get(order.get('type'), {}).get('name', 'Заказ')
+        order_name = ORDER_TYPE_NAMES.get(order.get('type'), 'Заказ')
         prefix = '⏸ ' if is_order_paused(order) else ''
         label = f"{prefix}#{order_id} · {truncate_for_button(order_name)}"
         keyboard.append([InlineKeyboardButton(label, callback_data=f'profile_order_{order_id}')])
-    keyboard.append([InlineKeyboardButton("⬅️ Профиль", callback_data='profile')])
+    keyboard.append([back_button('profile', "⬅️ Профиль")])
     await edit_or_send(update, context, "\n".join(lines), keyboard)
     return PROFILE_ORDERS
 
@@ -2112,7 +3110,7 @@ async def profile_show_order_detail(update: Update, context: ContextTypes.DEFAUL
     log_user_action(user.id, user.username, f"Профиль: заказ #{order_id}", user.full_name)
     order_number = html.escape(str(order.get('order_id', order_id)))
     header = f"📦 <b>Заказ #{order_number}</b>"
-    details = build_order_detail_text(order)
+    details = build_order_detail_text(user.id, order)
     parts = [header]
     if notice:
         parts.append(f"<i>{html.escape(notice)}</i>")
@@ -2122,13 +3120,14 @@ async def profile_show_order_detail(update: Update, context: ContextTypes.DEFAUL
         [InlineKeyboardButton(pause_label, callback_data=f'profile_order_pause_{order_id}')],
         [InlineKeyboardButton("🔔 Напомнить менеджеру", callback_data=f'profile_order_remind_{order_id}')],
         [InlineKeyboardButton("🗑 Удалить заказ", callback_data=f'profile_order_delete_{order_id}')],
-        [InlineKeyboardButton("⬅️ К заказам", callback_data='profile_orders')],
+        [back_button('profile_orders', "⬅️ К заказам")],
         [InlineKeyboardButton("🏠 Профиль", callback_data='profile')],
     ]
     await edit_or_send(update, context, "\n\n".join(parts), keyboard)
     return PROFILE_ORDER_DETAIL
 
 
+@debounce_clicks
 async def profile_toggle_order_pause(update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str):
     user = update.effective_user
     order, _ = find_user_order(user.id, order_id)
@@ -2147,13 +3146,14 @@ async def profile_toggle_order_pause(update: Update, context: ContextTypes.DEFAU
         order['client_paused'] = True
         notice = "Заказ поставлен на паузу. Мы подождём вашего сигнала."
         action = "поставил на паузу"
-    save_json(ORDERS_FILE, ORDERS)
+    invalidate_order_stats()
+    save_order_change(user.id, order)
     log_user_action(user.id, user.username, f"Профиль: {action} заказ #{order_id}", user.full_name)
-    if ADMIN_CHAT_ID:
-        await notify_admin_order_event(context, user, order, action)
+    await notify_admin_order_event(context, user, order, action)
     return await profile_show_order_detail(update, context, order_id, notice=notice)
 
 
+@debounce_clicks
 async def profile_delete_order(update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str):
     user = update.effective_user
     order, user_orders = find_user_order(user.id, order_id)
@@ -2162,23 +3162,22 @@ async def profile_delete_order(update: Update, context: ContextTypes.DEFAULT_TYP
     user_orders[:] = [o for o in user_orders if str(o.get('order_id')) != str(order_id)]
     if not user_orders:
         ORDERS.pop(str(user.id), None)
-    save_json(ORDERS_FILE, ORDERS)
+    drop_order(user.id, order)
+    save_order_removal(user.id, order_id)
     log_user_action(user.id, user.username, f"Профиль: удалил заказ #{order_id}", user.full_name)
-    if ADMIN_CHAT_ID:
-        await notify_admin_order_event(context, user, order, 'удалил', extra_note='Клиент запросил отмену заказа через профиль.')
+    await notify_admin_order_event(context, user, order, 'удалил', extra_note='Клиент запросил отмену заказа через профиль.')
     return await profile_show_orders(update, context, notice='Заказ удалён. Если планы изменятся — создайте новый заказ.')
 
 
+@debounce_clicks
 async def profile_remind_order(update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str):
     user = update.effective_user
     order, _ = find_user_order(user.id, order_id)
     if not order:
         return await profile_show_orders(update, context, notice="Заказ не найден.")
     log_user_action(user.id, user.username, f"Профиль: напомнил о заказе #{order_id}", user.full_name)
-    if ADMIN_CHAT_ID:
-        deadline = order.get('deadline_label') or f"{order.get('deadline_days', '—')} дней"
-        extra = f"Напоминание от клиента. Срок: {deadline}."
-        await notify_admin_order_event(context, user, order, 'напомнил о', extra_note=extra)
+    extra = f"Напоминание от клиента. Срок: {order_deadline_display(order)}."
+    await notify_admin_order_event(context, user, order, 'напомнил о', extra_note=extra)
     notice = "Напоминание отправлено менеджеру. Мы скоро свяжемся!"
     return await profile_show_order_detail(update, context, order_id, notice=notice)
 
@@ -2210,7 +3209,7 @@ async def profile_show_feedbacks(update: Update, context: ContextTypes.DEFAULT_T
                 row = []
         if row:
             keyboard.append(row)
-    keyboard.append([InlineKeyboardButton("⬅️ Профиль", callback_data='profile')])
+    keyboard.append([back_button('profile', "⬅️ Профиль")])
     await edit_or_send(update, context, "\n".join(lines), keyboard)
     return PROFILE_FEEDBACKS
 
@@ -2221,8 +3220,7 @@ async def profile_prompt_feedback(update: Update, context: ContextTypes.DEFAULT_
         f"Напишите текстовым сообщением, что понравилось или что можно улучшить. За отзыв начислим {FEEDBACK_BONUS_AMOUNT} ₽ на бонусный счёт.\n\n"
         "Чтобы отменить, нажмите «⬅️ Профиль» или отправьте /cancel."
     )
-    keyboard = [[InlineKeyboardButton("⬅️ Профиль", callback_data='profile_feedbacks')]]
-    await edit_or_send(update, context, text, keyboard)
+    await edit_or_send(update, context, text, FEEDBACK_INPUT_MARKUP)
     return PROFILE_FEEDBACK_INPUT
 
 
@@ -2237,7 +3235,7 @@ async def input_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Добавление отзыва отменено.")
         return await profile_show_feedbacks(update, context, notice='Отмена добавления отзыва.')
     entries = get_feedback_entries(user_id)
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    timestamp = now_timestamp()
     entries.append({'text': text, 'created_at': timestamp})
     save_feedback_entries(user_id, entries)
     add_bonus_operation(user_id, FEEDBACK_BONUS_AMOUNT, 'credit', 'Отзыв клиента')
@@ -2248,7 +3246,7 @@ async def input_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"⭐ Новый отзыв от <a href=\"{html.escape(user_link, quote=True)}\">{html.escape(user.full_name or user.first_name or user_id)}</a>\n"
             f"Текст: {html.escape(text)}"
         )
-        await context.bot.send_message(ADMIN_CHAT_ID, admin_text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        enqueue_admin_notification('text', admin_text)
     return await profile_show_feedbacks(update, context, notice='Отзыв сохранён и передан менеджеру.')
 
 
@@ -2272,7 +3270,7 @@ async def profile_delete_feedback(update: Update, context: ContextTypes.DEFAULT_
             f"🗑 Клиент <a href=\"{html.escape(user_link, quote=True)}\">{html.escape(user.full_name or user.first_name or user_id)}</a> удалил отзыв.\n"
             f"Текст: {html.escape(removed_text)}"
         )
-        await context.bot.send_message(ADMIN_CHAT_ID, admin_text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        enqueue_admin_notification('text', admin_text)
     return await profile_show_feedbacks(update, context, notice='Отзыв удалён.')
 
 
@@ -2304,17 +3302,13 @@ async def profile_show_referrals(update: Update, context: ContextTypes.DEFAULT_T
             lines.append(f"{idx}. {name_html} — {status} (начислено бонусов {bonus_total} ₽)")
     ref_link = context.user_data.get('ref_link')
     if not ref_link:
-        bot_username = (await context.bot.get_me()).username
-        ref_link = f"https://t.me/{bot_username}?start={user_id}"
+        ref_link = build_ref_link(context, user_id)
         context.user_data['ref_link'] = ref_link
     lines.extend([
         "",
         f"Ваша ссылка: <a href=\"{html.escape(ref_link, quote=True)}\">{html.escape(ref_link)}</a>",
     ])
-    keyboard = [
-        [InlineKeyboardButton("⬅️ Профиль", callback_data='profile')],
-    ]
-    await edit_or_send(update, context, "\n".join(lines), keyboard)
+    await edit_or_send(update, context, "\n".join(lines), PROFILE_BACK_MARKUP)
     return PROFILE_REFERRALS
 
 
@@ -2345,10 +3339,7 @@ async def profile_show_bonuses(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         lines.append("\nИстория операций появится после начислений.")
     lines.append("\nБонусами можно оплатить до 50% стоимости заказа. Не забывайте использовать их в течение 30 дней — иначе они сгорают.")
-    keyboard = [
-        [InlineKeyboardButton("⬅️ Профиль", callback_data='profile')],
-    ]
-    await edit_or_send(update, context, "\n".join(lines), keyboard)
+    await edit_or_send(update, context, "\n".join(lines), PROFILE_BACK_MARKUP)
     return PROFILE_BONUSES
 
 # Показ FAQ
@@ -2357,48 +3348,49 @@ async def show_faq(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await answer_callback_query(query, context)
     data = query.data
     if data.startswith('faq_'):
-        idx = int(data[4:])
-        item = FAQ_ITEMS[idx]
-        text = f"❓ {item['question']}\n\n{item['answer']}"
-        keyboard = [[InlineKeyboardButton("Назад к FAQ", callback_data='faq')],
-                    [InlineKeyboardButton("Меню", callback_data='back_to_main')]]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        text = FAQ_ANSWER_TEXTS[int(data[4:])]
+        await edit_message_if_changed(query, context, text, reply_markup=FAQ_DETAIL_MARKUP)
         return FAQ_DETAILS
     elif data == 'back_to_main':
         return await main_menu(update, context)
     user = update.effective_user
     log_user_action(user.id, user.username, "FAQ", user.full_name)
     text = "❓ FAQ: Выберите вопрос"
-    keyboard = [[InlineKeyboardButton(item['question'], callback_data=f'faq_{i}')] for i, item in enumerate(FAQ_ITEMS)]
-    keyboard.append([InlineKeyboardButton("⬅️ Меню", callback_data='back_to_main')])
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    await edit_message_if_changed(query, context, text, reply_markup=FAQ_LIST_MARKUP)
     return SHOW_FAQ
 
 # Показ админ меню
 async def show_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [InlineKeyboardButton("📦 Все заказы", callback_data='admin_orders'), InlineKeyboardButton("🔥 Последние", callback_data='admin_recent_orders')],
-        [InlineKeyboardButton("👥 Лиды", callback_data='admin_leads'), InlineKeyboardButton("🎁 Бонусы", callback_data='admin_bonuses')],
-        [InlineKeyboardButton("💲 Цены", callback_data='admin_prices'), InlineKeyboardButton("📤 Экспорт", callback_data='admin_export')],
-        [InlineKeyboardButton("⬅️ Выход", callback_data='back_to_main')]
-    ]
     text = "🔐 Админ-панель. Выберите раздел:"
     if update.callback_query:
         query = update.callback_query
         await answer_callback_query(query, context)
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        await edit_message_if_changed(query, context, text, reply_markup=ADMIN_MENU_MARKUP)
     else:
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        await update.message.reply_text(text, reply_markup=ADMIN_MENU_MARKUP)
     return ADMIN_MENU
 
 def find_order_for_admin(user_id, order_id):
     user_key = str(user_id)
-    user_orders = ORDERS.get(user_key, [])
-    for order in user_orders:
-        if str(order.get('order_id')) == str(order_id):
-            normalize_order_record(order, user_key)
-            return order, user_orders
-    return None, user_orders
+    order = ORDER_INDEX.get((user_key, str(order_id)))
+    if order is not None:
+        normalize_order_record(order, user_key)
+    return order, ORDERS.get(user_key, [])
+
+
+ORDER_TARGET_ID_LIMIT = 1 << 32
+
+
+def pack_order_target(user_id, order_id) -> int:
+    user_id, order_id = int(user_id), int(order_id)
+    # Номер заказа занимает младшие 32 бита: иначе он наложится на user_id и распакуется в чужой заказ
+    if user_id < 0 or not 0 <= order_id < ORDER_TARGET_ID_LIMIT:
+        raise ValueError(f"Заказ #{order_id} клиента {user_id} не упаковывается в число")
+    return (user_id << 32) | order_id
+
+
+def unpack_order_target(target: int) -> tuple:
+    return target >> 32, target & 0xFFFFFFFF
 
 
 def set_order_status(order: dict, status_code: str, note: Optional[str] = None) -> bool:
@@ -2407,10 +3399,11 @@ def set_order_status(order: dict, status_code: str, note: Optional[str] = None)
     if target_code == current_code:
         return False
     label = get_status_label(target_code)
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    timestamp = now_timestamp()
     order['status_code'] = target_code
     order['status'] = label
     order['updated_at'] = timestamp
+    invalidate_order_stats()
     history = order.setdefault('status_history', [])
     history.append({
         'code': target_code,
@@ -2470,7 +3463,7 @@ async def award_referral_bonus(context: ContextTypes.DEFAULT_TYPE, user_id: int,
         status='реферал оплатил заказ',
         bonus_increment=bonus_amount,
     )
-    save_json(REFERRALS_FILE, REFERALS)
+    schedule_save(REFERRALS_FILE, REFERALS)
     if referrer_int:
         await safe_send_message(
             context.bot,
@@ -2497,28 +3490,24 @@ def available_bonus_for_order(order: dict) -> int:
     return max(0, limit - used)
 
 
-def collect_all_orders() -> list:
+def collect_all_orders(limit: Optional[int] = None) -> list:
     collected = []
-    for user_id, orders in ORDERS.items():
-        if not isinstance(orders, list):
+    for neg_created_ms, user_key, order_id in ORDER_TIME_INDEX:
+        if limit is not None and len(collected) >= limit:
+            break
+        order = ORDER_INDEX.get((user_key, order_id))
+        if order is None:
             continue
-        for order in orders:
-            if not isinstance(order, dict):
-                continue
-            normalize_order_record(order, user_id)
-            created = parse_datetime(order.get('created_at'))
-            updated = parse_datetime(order.get('updated_at'))
-            try:
-                owner_id = int(user_id)
-            except (TypeError, ValueError):
-                owner_id = user_id
-            collected.append({
-                'user_id': owner_id,
-                'order': order,
-                'created': created,
-                'updated': updated,
-            })
-    collected.sort(key=lambda item: item['created'], reverse=True)
+        try:
+            owner_id = int(user_key)
+        except (TypeError, ValueError):
+            owner_id = user_key
+        collected.append({
+            'user_id': owner_id,
+            'order': order,
+            'created': datetime.fromtimestamp(-neg_created_ms / 1000),
+            'updated': parse_datetime(order.get('updated_at')),
+        })
     return collected
 
 
@@ -2549,14 +3538,35 @@ def chunk_buttons(buttons, size=2):
     return [buttons[i:i + size] for i in range(0, len(buttons), size) if buttons[i:i + size]]
 
 
+def get_admin_order_static_html(user_id, order: dict) -> tuple:
+    key = (str(user_id), str(order.get('order_id')))
+    cached = ADMIN_ORDER_STATIC_HTML.get(key)
+    if cached is None:
+        order_name = ORDER_TYPE_NAMES.get(order.get('type'), 'Неизвестный тип')
+        details = []
+        if order.get('deadline_label') or order.get('deadline_days'):
+            details.append(f"Срок: {html.escape(order_deadline_display(order))}")
+        if order.get('topic'):
+            details.append(f"Тема: {html.escape(order.get('topic', ''))}")
+        if order.get('requirements'):
+            details.append(f"Требования: {html.escape(order.get('requirements', ''))}")
+        cached = (
+            f"Тип: {html.escape(order_name)}",
+            f"Создан: {html.escape(str(order.get('created_at', '—')))}",
+            tuple(details),
+            f"Допы: {upsell_summary_html(order.get('upsells'))}",
+            f"Файлы: {len(order.get('files', []) or [])}",
+        )
+        ADMIN_ORDER_STATIC_HTML[key] = cached
+    return cached
+
+
 def build_admin_order_view(user_id, order: dict, notice: Optional[str] = None):
     owner_id = int(user_id)
-    order_name = ORDER_TYPES.get(order.get('type'), {}).get('name', 'Неизвестный тип')
+    type_line, created_line, detail_lines, upsell_line, files_line = get_admin_order_static_html(user_id, order)
     contact_link = order.get('contact_link') or build_user_contact_link(owner_id)
     contact_display = order.get('contact') or format_user_display_name(owner_id)
     contact_html = f"<a href=\"{html.escape(contact_link, quote=True)}\">{html.escape(contact_display)}</a>"
-    upsell_titles = [UPSELL_LABELS.get(u, u) for u in order.get('upsells', [])]
-    upsell_text = ', '.join(upsell_titles) if upsell_titles else 'нет'
     history_lines = []
     for item in order.get('status_history', [])[-5:]:
         if isinstance(item, dict):
@@ -2579,26 +3589,20 @@ def build_admin_order_view(user_id, order: dict, notice: Optional[str] = None):
     if notice:
         lines.append(f"<i>{html.escape(notice)}</i>")
     lines.extend([
-        f"Тип: {html.escape(order_name)}",
+        type_line,
         f"Клиент: {contact_html}",
         f"Телеграм: <a href=\"{html.escape(build_user_contact_link(owner_id), quote=True)}\">{html.escape(format_user_display_name(owner_id))}</a>",
         f"Статус: {html.escape(order.get('status', '—'))}",
-        f"Создан: {html.escape(str(order.get('created_at', '—')))}",
+        created_line,
         f"Обновлён: {html.escape(str(order.get('updated_at', '—')))}",
         f"Цена: {order.get('price', 0)} ₽ (бонусами оплачено {bonus_used} ₽)",
     ])
-    if order.get('deadline_label') or order.get('deadline_days'):
-        deadline_display = order.get('deadline_label') or f"{order.get('deadline_days', '—')} дней"
-        lines.append(f"Срок: {html.escape(deadline_display)}")
-    if order.get('topic'):
-        lines.append(f"Тема: {html.escape(order.get('topic', ''))}")
-    if order.get('requirements'):
-        lines.append(f"Требования: {html.escape(order.get('requirements', ''))}")
+    lines.extend(detail_lines)
     lines.append(f"Контакт клиента: {contact_html}")
-    lines.append(f"Допы: {html.escape(upsell_text)}")
+    lines.append(upsell_line)
     if ref_info:
         lines.append(f"Реферер: {ref_info}")
-    lines.append(f"Файлы: {len(order.get('files', []) or [])}")
+    lines.append(files_line)
     if history_lines:
         lines.append("\nИстория статусов:")
         lines.extend(history_lines)
@@ -2629,7 +3633,7 @@ def build_admin_order_view(user_id, order: dict, notice: Optional[str] = None):
     keyboard_buttons.append([
         InlineKeyboardButton("🗑 Удалить заказ", callback_data=f'admin_delete_{user_id}_{order.get('order_id')}')
     ])
-    keyboard_buttons.append([InlineKeyboardButton("⬅️ К списку", callback_data='admin_orders')])
+    keyboard_buttons.append([back_button('admin_orders', "⬅️ К списку")])
     markup = InlineKeyboardMarkup(keyboard_buttons)
     return "\n".join(lines), markup
 
@@ -2637,51 +3641,43 @@ def build_admin_order_view(user_id, order: dict, notice: Optional[str] = None):
 async def admin_show_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await answer_callback_query(query, context)
-    orders = collect_all_orders()
-    status_counts = {}
-    for item in orders:
-        status_label = item['order'].get('status') or get_status_label(item['order'].get('status_code'))
-        status_counts[status_label] = status_counts.get(status_label, 0) + 1
+    orders = collect_all_orders(limit=15)
+    total_orders, status_counts = get_order_stats()
     lines = [
         "📦 <b>Все заказы</b>",
-        f"Всего заказов: {len(orders)}",
+        f"Всего заказов: {total_orders}",
     ]
     if status_counts:
         lines.append("По статусам:")
-        for label, count in sorted(status_counts.items(), key=lambda x: x[0]):
+        for label, count in status_counts:
             lines.append(f"• {html.escape(label)} — {count}")
     lines.append("")
-    if orders:
-        lines.append("Последние 15 заказов:")
-        for item in orders[:15]:
-            order = item['order']
-            user_id = item['user_id']
-            order_name = ORDER_TYPES.get(order.get('type'), {}).get('name', 'Неизвестный тип')
-            link = build_user_contact_link(user_id)
-            display = html.escape(format_user_display_name(user_id))
-            status = html.escape(order.get('status', '—'))
-            created = item['created'].strftime('%Y-%m-%d %H:%M')
-            lines.append(
-                f"#{order.get('order_id')} · {status} · {html.escape(order_name)} · {order.get('price', 0)} ₽ · "
-                f"<a href=\"{html.escape(link, quote=True)}\">{display}</a> · {created}"
-            )
-    else:
-        lines.append("Заказов пока нет.")
-    keyboard = [
-        [
+    lines.append("Последние 15 заказов:" if orders else "Заказов пока нет.")
+    # Строки текста и кнопки собираем за один проход по заказам
+    order_rows = []
+    for item in orders:
+        order = item['order']
+        user_id = item['user_id']
+        order_id = order.get('order_id')
+        order_name = ORDER_TYPE_NAMES.get(order.get('type'), 'Неизвестный тип')
+        link = build_user_contact_link(user_id)
+        display = html.escape(format_user_display_name(user_id))
+        status = html.escape(order.get('status', '—'))
+        created = short_timestamp(order.get('created_at'), item['created'])
+        lines.append(
+            f"#{order_id} · {status} · {html.escape(order_name)} · {order.get('price', 0)} ₽ · "
+            f"<a href=\"{html.escape(link, quote=True)}\">{display}</a> · {created}"
+        )
+        order_rows.append((
             InlineKeyboardButton(
-                f"#{item['order'].get('order_id')} · {item['order'].get('status', '')}",
-                callback_data=f"admin_view_{item['user_id']}_{item['order'].get('order_id')}"
-            )
-        ]
-        for item in orders[:15]
-    ]
-    keyboard.append([InlineKeyboardButton("🔥 Последние", callback_data='admin_recent_orders')])
-    keyboard.append([InlineKeyboardButton("⬅️ Меню", callback_data='admin_menu')])
+                f"#{order_id} · {order.get('status', '')}",
+                callback_data=f"admin_view_{user_id}_{order_id}"
+            ),
+        ))
     await query.edit_message_text(
         "\n".join(lines),
         parse_mode=ParseMode.HTML,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=InlineKeyboardMarkup(tuple(order_rows) + ADMIN_ORDERS_FOOTER_ROWS),
         disable_web_page_preview=True,
     )
     return ADMIN_MENU
@@ -2690,14 +3686,14 @@ async def admin_show_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def admin_show_recent_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await answer_callback_query(query, context)
-    orders = collect_all_orders()[:8]
+    orders = collect_all_orders(limit=8)
     lines = ["🔥 <b>Последние заказы</b>"]
     if not orders:
         lines.append("Пока нет новых заказов. Проверьте позже.")
     for item in orders:
         order = item['order']
         user_id = item['user_id']
-        order_name = ORDER_TYPES.get(order.get('type'), {}).get('name', 'Неизвестный тип')
+        order_name = ORDER_TYPE_NAMES.get(order.get('type'), 'Неизвестный тип')
         lines.extend([
             f"\n#{order.get('order_id')} · {html.escape(order.get('status', '—'))} · {html.escape(order_name)}",
             f"Клиент: <a href=\"{html.escape(build_user_contact_link(user_id), quote=True)}\">{html.escape(format_user_display_name(user_id))}</a>",
@@ -2710,16 +3706,14 @@ async def admin_show_recent_orders(update: Update, context: ContextTypes.DEFAULT
             lines.append(f"Тема: {html.escape(order.get('topic', ''))}")
         if order.get('requirements'):
             lines.append(f"Требования: {html.escape(order.get('requirements', ''))}")
-    keyboard = [
-        [InlineKeyboardButton(f"Открыть #{order['order'].get('order_id')}", callback_data=f"admin_view_{order['user_id']}_{order['order'].get('order_id')}")]
+    order_rows = tuple(
+        (InlineKeyboardButton(f"Открыть #{order['order'].get('order_id')}", callback_data=f"admin_view_{order['user_id']}_{order['order'].get('order_id')}"),)
         for order in orders
-    ]
-    keyboard.append([InlineKeyboardButton("📦 Все заказы", callback_data='admin_orders')])
-    keyboard.append([InlineKeyboardButton("⬅️ Меню", callback_data='admin_menu')])
+    )
     await query.edit_message_text(
         "\n".join(lines),
         parse_mode=ParseMode.HTML,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=InlineKeyboardMarkup(order_rows + ADMIN_RECENT_ORDERS_FOOTER_ROWS),
         disable_web_page_preview=True,
     )
     return ADMIN_MENU
@@ -2739,15 +3733,15 @@ async def admin_show_leads(update: Update, context: ContextTypes.DEFAULT_TYPE):
         link = html.escape(build_user_contact_link(int(user_id)), quote=True)
         first_seen = profile.get('first_seen', '—')
         last_action = html.escape(str(profile.get('last_action', '—')))
+        last_seen_text = profile.get('last_seen') or last_seen.strftime('%Y-%m-%d %H:%M')
         lines.append(
-            f"{idx}. <a href=\"{link}\">{display}</a> — последняя активность {html.escape(str(profile.get('last_seen', last_seen.strftime('%Y-%m-%d %H:%M'))))}"
+            f"{idx}. <a href=\"{link}\">{display}</a> — последняя активность {html.escape(str(last_seen_text))}"
         )
         lines.append(f"   Первое посещение: {html.escape(str(first_seen))}. Действие: {last_action}")
-    keyboard = [[InlineKeyboardButton("⬅️ Меню", callback_data='admin_menu')]]
     await query.edit_message_text(
         "\n".join(lines),
         parse_mode=ParseMode.HTML,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=ADMIN_MENU_BACK_MARKUP,
         disable_web_page_preview=True,
     )
     return ADMIN_MENU
@@ -2764,14 +3758,14 @@ async def admin_show_bonuses(update: Update, context: ContextTypes.DEFAULT_TYPE)
         except (TypeError, ValueError):
             uid = user_id
         entries.append({'user_id': uid, 'entry': entry})
-    entries.sort(key=lambda item: item['entry'].get('balance', 0), reverse=True)
+    top_entries = heapq.nlargest(15, entries, key=lambda item: item['entry'].get('balance', 0))
     lines = [
         "🎁 <b>Бонусные счета и рефералы</b>",
         f"Активных счетов: {len(entries)}",
         "Напоминание: бонусы автоматически сгорают через 30 дней без активности и могут покрыть до 50% заказа.",
         "",
     ]
-    for idx, item in enumerate(entries[:15], 1):
+    for idx, item in enumerate(top_entries, 1):
         entry = item['entry']
         user_id = item['user_id']
         referrals = len(get_referrals_for_referrer(user_id))
@@ -2781,9 +3775,9 @@ async def admin_show_bonuses(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
     keyboard = [
         [InlineKeyboardButton(f"{format_user_display_name(item['user_id'])} · {item['entry'].get('balance', 0)} ₽", callback_data=f"admin_bonus_user_{item['user_id']}")]
-        for item in entries[:15]
+        for item in top_entries
     ]
-    keyboard.append([InlineKeyboardButton("⬅️ Меню", callback_data='admin_menu')])
+    keyboard.append([back_button('admin_menu', "⬅️ Меню")])
     await query.edit_message_text(
         "\n".join(lines),
         parse_mode=ParseMode.HTML,
@@ -2842,7 +3836,7 @@ async def admin_view_bonus_user(
     keyboard = [
         [InlineKeyboardButton("📈 Начислить", callback_data=f'admin_bonus_credit_{target_user_id}')],
         [InlineKeyboardButton("📉 Списать", callback_data=f'admin_bonus_debit_{target_user_id}')],
-        [InlineKeyboardButton("⬅️ Назад", callback_data='admin_bonuses')],
+        [back_button('admin_bonuses')],
     ]
     await query.edit_message_text(
         "\n".join(lines),
@@ -2881,7 +3875,7 @@ async def admin_view_order(update: Update, context: ContextTypes.DEFAULT_TYPE, u
     if not order:
         await query.edit_message_text(
             "Заказ не найден.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ К списку", callback_data='admin_orders')]])
+            reply_markup=ADMIN_ORDERS_BACK_MARKUP
         )
         return ADMIN_MENU
     text, markup = build_admin_order_view(user_id, order, notice)
@@ -2894,6 +3888,7 @@ async def admin_view_order(update: Update, context: ContextTypes.DEFAULT_TYPE, u
     return ADMIN_MENU
 
 
+@debounce_clicks
 async def admin_change_order_status(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
@@ -2907,27 +3902,44 @@ async def admin_change_order_status(
         await answer_callback_query(query, context)
         await query.edit_message_text(
             "Заказ не найден.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ К списку", callback_data='admin_orders')]])
+            reply_markup=ADMIN_ORDERS_BACK_MARKUP
         )
         return ADMIN_MENU
     changed = set_order_status(order, status_code, note='Изменено администратором')
-    save_json(ORDERS_FILE, ORDERS)
-    notice = None
-    if changed:
-        notice = 'Статус обновлён.'
+    if not changed:
+        return await admin_view_order(update, context, user_id, order_id)
+    save_order_change(user_id, order)
+    if status_code == 'paid':
+        # Бонусы начисляются до отправки сообщений: ошибка должна дойти до error_handler, а не потеряться в gather
+        await process_paid_order(context, int(user_id), order)
+        # Флаги начисленных бонусов тоже должны попасть в файл заказов
+        save_order_change(user_id, order)
+
+    async def notify_client():
         try:
-            await safe_send_message(
-                context.bot,
-                int(user_id),
-                f"Статус вашего заказа #{order.get('order_id')} обновлён: {get_status_label(status_code)}.",
-            )
+            client_id = int(user_id)
         except (TypeError, ValueError):
-            pass
-        if status_code == 'paid':
-            await process_paid_order(context, int(user_id), order)
-    return await admin_view_order(update, context, user_id, order_id, notice=notice)
+            return
+        await safe_send_message(
+            context.bot,
+            client_id,
+            f"Статус вашего заказа #{order.get('order_id')} обновлён: {get_status_label(status_code)}.",
+        )
+
+    # Ответ администратору и уведомление клиента не зависят друг от друга — отправляем параллельно
+    admin_result, client_result = await asyncio.gather(
+        admin_view_order(update, context, user_id, order_id, notice='Статус обновлён.'),
+        notify_client(),
+        return_exceptions=True,
+    )
+    if isinstance(client_result, Exception):
+        logger.warning(f"Не удалось уведомить пользователя {user_id} о смене статуса: {client_result}")
+    if isinstance(admin_result, Exception):
+        raise admin_result
+    return admin_result
 
 
+@debounce_clicks
 async def admin_delete_order(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: str, order_id: str):
     query = update.callback_query
     await answer_callback_query(query, context)
@@ -2935,16 +3947,17 @@ async def admin_delete_order(update: Update, context: ContextTypes.DEFAULT_TYPE,
     if not order:
         await query.edit_message_text(
             "Заказ не найден.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ К списку", callback_data='admin_orders')]])
+            reply_markup=ADMIN_ORDERS_BACK_MARKUP
         )
         return ADMIN_MENU
     user_orders[:] = [ordr for ordr in user_orders if str(ordr.get('order_id')) != str(order_id)]
     if not user_orders:
         ORDERS.pop(str(user_id), None)
-    save_json(ORDERS_FILE, ORDERS)
+    drop_order(user_id, order)
+    save_order_removal(user_id, order_id)
     await query.edit_message_text(
         "Заказ удалён.",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ К списку", callback_data='admin_orders')]])
+        reply_markup=ADMIN_ORDERS_BACK_MARKUP
     )
     return ADMIN_MENU
 
@@ -2955,11 +3968,12 @@ async def admin_handle_order_bonus_request(
     user_id: str,
     order_id: str,
 ):
-    context.user_data['admin_state'] = {
-        'name': 'order_bonus',
-        'user_id': user_id,
-        'order_id': order_id,
-    }
+    try:
+        target = pack_order_target(user_id, order_id)
+    except (TypeError, ValueError):
+        return await admin_view_order(update, context, user_id, order_id, notice='Некорректный номер заказа.')
+    context.user_data['admin_state'] = 'order_bonus'
+    context.user_data['admin_order_target'] = target
     await admin_view_order(
         update,
         context,
@@ -2985,7 +3999,7 @@ def build_admin_prices_view():
         )
         keyboard.append([InlineKeyboardButton(info['name'], callback_data=f'admin_price_{key}')])
     keyboard.append([InlineKeyboardButton("Переключить режим", callback_data='admin_price_mode')])
-    keyboard.append([InlineKeyboardButton("⬅️ Меню", callback_data='admin_menu')])
+    keyboard.append([back_button('admin_menu', "⬅️ Меню")])
     return "\n".join(lines), InlineKeyboardMarkup(keyboard)
 
 
@@ -3014,7 +4028,7 @@ async def admin_view_price_type(
     if not info:
         await query.edit_message_text(
             "Тип не найден.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад", callback_data='admin_prices')]])
+            reply_markup=ADMIN_PRICES_BACK_MARKUP
         )
         return ADMIN_MENU
     prices = PRICES.get(order_type_key, DEFAULT_PRICES.get(order_type_key, {'base': 0, 'min': 0}))
@@ -3023,6 +4037,10 @@ async def admin_view_price_type(
         f"Базовая цена: {prices.get('base', 0)} ₽",
         f"Минимальная цена: {prices.get('min', prices.get('base', 0))} ₽",
     ]
+    grid = calculate_price_grid(order_type_key)
+    if grid:
+        lines.append(f"\nИтоговые цены по срокам (режим {current_pricing_mode}):")
+        lines.extend(f"• {html.escape(preset['label'])} — {price} ₽" for preset, price in grid)
     if notice:
         lines.append(f"<i>{html.escape(notice)}</i>")
     lines.append("\nИспользуйте кнопки ниже для быстрой корректировки или установите точное значение.")
@@ -3043,7 +4061,7 @@ async def admin_view_price_type(
         InlineKeyboardButton("✏️ Установить базовую", callback_data=f'admin_price_set_{order_type_key}_base'),
         InlineKeyboardButton("✏️ Установить минимум", callback_data=f'admin_price_set_{order_type_key}_min'),
     ])
-    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data='admin_prices')])
+    keyboard.append([back_button('admin_prices')])
     await query.edit_message_text(
         "\n".join(lines),
         parse_mode=ParseMode.HTML,
@@ -3109,65 +4127,76 @@ def _serialize_export_value(value):
     return str(value)
 
 
+def build_orders_csv(orders_snapshot: list) -> Optional[io.BytesIO]:
+    if not orders_snapshot:
+        return None
+
+    # dict сохраняет порядок появления полей и даёт O(1) проверку вхождения
+    encountered_fields = {}
+    for order in orders_snapshot:
+        encountered_fields.update(dict.fromkeys(order))
+
+    preferred = [field for field in EXPORT_FIELD_ORDER if field in encountered_fields]
+    preferred_set = set(preferred)
+    fieldnames = preferred + [field for field in encountered_fields if field not in preferred_set]
+
+    buffer = io.BytesIO()
+    csvfile = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+    writer = csv.DictWriter(csvfile, fieldnames=fieldnames, restval='', extrasaction='ignore')
+    writer.writeheader()
+    # Строки сериализуются по одной прямо в writer, без промежуточного списка всех заказов
+    writer.writerows(
+        {key: _serialize_export_value(value) for key, value in order.items()}
+        for order in orders_snapshot
+    )
+    csvfile.flush()
+    csvfile.detach()
+    buffer.seek(0)
+    return buffer
+
+
 async def admin_export_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await answer_callback_query(query, context)
 
-    export_rows = []
-    encountered_fields = []
-
-    def register_field(field_name: str):
-        if field_name not in encountered_fields:
-            encountered_fields.append(field_name)
-
-    for orders in ORDERS.values():
-        if not isinstance(orders, list):
-            continue
-        for order in orders:
-            if not isinstance(order, dict):
-                continue
-            row = {}
-            for key, value in order.items():
-                register_field(key)
-                row[key] = _serialize_export_value(value)
-            export_rows.append(row)
+    # Снимок заказов делаем в цикле событий, а сборку CSV уносим в поток
+    orders_snapshot = [
+        dict(order)
+        for orders in ORDERS.values()
+        if isinstance(orders, list)
+        for order in orders
+        if isinstance(order, dict)
+    ]
+    export_buffer = await asyncio.to_thread(build_orders_csv, orders_snapshot)
 
-    if not export_rows:
+    if export_buffer is None:
         await query.edit_message_text(
             "📂 Пока нет заказов для экспорта.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Меню", callback_data='admin_menu')]]),
+            reply_markup=ADMIN_MENU_BACK_MARKUP,
         )
         return ADMIN_MENU
 
-    preferred = [field for field in EXPORT_FIELD_ORDER if field in encountered_fields]
-    remaining = [field for field in encountered_fields if field not in preferred]
-    fieldnames = preferred + remaining
-
-    export_file = os.path.join(DATA_DIR, 'orders_export.csv')
-    with open(export_file, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
-        writer.writeheader()
-        for row in export_rows:
-            writer.writerow({field: row.get(field, '') for field in fieldnames})
-
-    try:
-        with open(export_file, 'rb') as export_handle:
-            await context.bot.send_document(ADMIN_CHAT_ID, export_handle)
-    finally:
+    # Буфер закрываем и при ошибке отправки; файл уходит в чат того админа, который его запросил
+    with export_buffer:
         try:
-            os.remove(export_file)
-        except OSError:
-            logger.warning("Не удалось удалить временный файл экспорта %s", export_file)
+            await context.bot.send_document(update.effective_chat.id, export_buffer, filename='orders_export.csv')
+        except TelegramError as e:
+            logger.error(f"Не удалось отправить экспорт заказов: {e}")
+            await query.edit_message_text(
+                "⚠️ Не удалось отправить экспорт. Попробуйте позже.",
+                reply_markup=ADMIN_MENU_BACK_MARKUP,
+            )
+            return ADMIN_MENU
 
     await query.edit_message_text(
         "📤 Экспорт отправлен в чат.",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Меню", callback_data='admin_menu')]]),
+        reply_markup=ADMIN_MENU_BACK_MARKUP,
     )
     return ADMIN_MENU
 
 # Админ старт
 async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id != ADMIN_CHAT_ID:
+    if update.effective_user.id not in ADMIN_IDS:
         await update.message.reply_text("Доступ запрещен!")
         return
     user = update.effective_user
@@ -3179,86 +4208,42 @@ async def admin_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await answer_callback_query(query, context)
     data = query.data
-    if data == 'admin_menu':
-        return await show_admin_menu(update, context)
-    if data == 'admin_orders':
-        return await admin_show_orders(update, context)
-    if data == 'admin_recent_orders':
-        return await admin_show_recent_orders(update, context)
-    if data == 'admin_leads':
-        return await admin_show_leads(update, context)
-    if data == 'admin_bonuses':
-        return await admin_show_bonuses(update, context)
-    if data.startswith('admin_bonus_user_'):
-        target = data.split('_', 3)[-1]
-        return await admin_view_bonus_user(update, context, target)
-    if data.startswith('admin_bonus_credit_'):
-        target = data.split('_', 3)[-1]
-        return await admin_prompt_manual_bonus(update, context, target, 'credit')
-    if data.startswith('admin_bonus_debit_'):
-        target = data.split('_', 3)[-1]
-        return await admin_prompt_manual_bonus(update, context, target, 'debit')
-    if data.startswith('admin_view_'):
-        _, _, payload = data.partition('admin_view_')
-        parts = payload.split('_')
-        if len(parts) >= 2:
-            user_id, order_id = parts[0], parts[1]
-            return await admin_view_order(update, context, user_id, order_id)
-    if data.startswith('admin_status_'):
-        _, _, payload = data.partition('admin_status_')
-        parts = payload.split('_')
-        if len(parts) >= 3:
-            user_id, order_id, status_code = parts[0], parts[1], parts[2]
-            return await admin_change_order_status(update, context, user_id, order_id, status_code)
-    if data.startswith('admin_order_bonus_'):
-        _, _, payload = data.partition('admin_order_bonus_')
-        parts = payload.split('_')
-        if len(parts) >= 2:
-            user_id, order_id = parts[0], parts[1]
-            return await admin_handle_order_bonus_request(update, context, user_id, order_id)
-    if data.startswith('admin_delete_'):
-        _, _, payload = data.partition('admin_delete_')
-        parts = payload.split('_')
-        if len(parts) >= 2:
-            user_id, order_id = parts[0], parts[1]
-            return await admin_delete_order(update, context, user_id, order_id)
-    if data == 'admin_prices':
-        return await admin_show_prices(update, context)
-    if data == 'admin_price_mode':
-        return await admin_toggle_pricing_mode(update, context)
-    if data.startswith('admin_price_adj_'):
-        _, _, payload = data.partition('admin_price_adj_')
-        parts = payload.split('_')
-        if len(parts) >= 3:
-            order_type, field, delta = parts[0], parts[1], parts[2]
-            try:
-                delta_value = int(delta)
-            except ValueError:
-                delta_value = 0
-            return await admin_adjust_price(update, context, order_type, field, delta_value)
-    if data.startswith('admin_price_set_'):
-        _, _, payload = data.partition('admin_price_set_')
-        parts = payload.split('_')
-        if len(parts) >= 2:
-            order_type, field = parts[0], parts[1]
+    handler = ADMIN_MENU_ROUTES.get(data)
+    if handler:
+        return await handler(update, context)
+    prefix, _, tail = data.rpartition('_')
+    handler = ADMIN_TARGET_ROUTES.get(prefix)
+    if handler:
+        return await handler(update, context, tail)
+    match = ADMIN_ORDER_CB_RE.match(data)
+    if match:
+        op, user_id, order_id, status_code = match.group('op', 'user_id', 'order_id', 'status_code')
+        if op == 'status':
+            if status_code:
+                return await admin_change_order_status(update, context, user_id, order_id, status_code)
+        elif not status_code:
+            return await ADMIN_ORDER_OPS[op](update, context, user_id, order_id)
+    match = ADMIN_PRICE_CB_RE.match(data)
+    if match:
+        op, order_type, field, delta = match.group('op', 'order_type', 'field', 'delta')
+        if op == 'adj' and delta:
+            return await admin_adjust_price(update, context, order_type, field, int(delta))
+        if op == 'set' and not delta:
             return await admin_prompt_price_input(update, context, order_type, field)
     if data.startswith('admin_price_'):
-        order_type = data.split('_', 2)[-1]
+        order_type = data[len('admin_price_'):]
         if order_type in ORDER_TYPES:
             return await admin_view_price_type(update, context, order_type)
-    if data == 'admin_export':
-        return await admin_export_orders(update, context)
-    if data == 'back_to_main':
-        return await main_menu(update, context)
     await query.edit_message_text(
         "Неизвестная команда. Возвращаюсь в админ-меню.",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Меню", callback_data='admin_menu')]])
+        reply_markup=ADMIN_MENU_BACK_MARKUP
     )
     return ADMIN_MENU
 
 # Обработчик сообщений админа
 async def admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = context.user_data.get('admin_state')
+    ud = context.user_data
+    state = ud.get('admin_state')
     if not state:
         await update.message.reply_text("Используйте кнопки админ-панели для действий.")
         return ADMIN_MENU
@@ -3268,7 +4253,8 @@ async def admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         state_name = state
     if text.lower() in {'отмена', '/cancel', 'cancel'}:
-        context.user_data.pop('admin_state', None)
+        ud.pop('admin_state', None)
+        ud.pop('admin_order_target', None)
         await update.message.reply_text("Действие отменено.")
         return ADMIN_MENU
     if state_name == 'bonus_manual':
@@ -3316,11 +4302,15 @@ async def admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(f"Списано {actual} ₽. Баланс: {balance_after} ₽.")
             else:
                 await update.message.reply_text("Недостаточно бонусов для списания.")
-        context.user_data.pop('admin_state', None)
+        ud.pop('admin_state', None)
         return ADMIN_MENU
     if state_name == 'order_bonus':
-        user_id = state.get('user_id')
-        order_id = state.get('order_id')
+        target = ud.get('admin_order_target')
+        if target is None:
+            ud.pop('admin_state', None)
+            await update.message.reply_text("Заказ не найден.")
+            return ADMIN_MENU
+        user_id, order_id = unpack_order_target(target)
         try:
             amount = int(text)
         except ValueError:
@@ -3331,13 +4321,14 @@ async def admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Заказ не найден.")
         else:
             applied = await debit_bonuses_for_order(context, int(user_id), order, amount)
-            save_json(ORDERS_FILE, ORDERS)
+            save_order_change(user_id, order)
             if applied:
                 balance = ensure_bonus_account(user_id).get('balance', 0)
                 await update.message.reply_text(f"Списано {applied} ₽ бонусов. Текущий баланс клиента: {balance} ₽.")
             else:
                 await update.message.reply_text("Не удалось списать бонусы. Проверьте баланс и лимит 50%.")
-        context.user_data.pop('admin_state', None)
+        ud.pop('admin_state', None)
+        ud.pop('admin_order_target', None)
         return ADMIN_MENU
     if state_name == 'price_manual':
         order_type = state.get('order_type')
@@ -3352,57 +4343,216 @@ async def admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             set_price_value(order_type, minimum=value)
         await update.message.reply_text("Цена обновлена.")
-        context.user_data.pop('admin_state', None)
+        ud.pop('admin_state', None)
         return ADMIN_MENU
     await update.message.reply_text("Не удалось обработать сообщение. Используйте кнопки панели.")
-    context.user_data.pop('admin_state', None)
+    ud.pop('admin_state', None)
     return ADMIN_MENU
 
-# Основная функция
-def main():
-    if not TELEGRAM_BOT_TOKEN:
-        logger.error(
-            "Не задан TELEGRAM_BOT_TOKEN. Укажите токен бота в файле .env перед запуском."
-        )
-        raise SystemExit(1)
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+# Таблицы маршрутов для кнопок с фиксированным callback_data
+MAIN_MENU_ROUTES = {
+    'make_order': select_order_type,
+    'price_list': show_price_list,
+    'price_calculator': price_calculator,
+    'profile': show_profile,
+    'faq': show_faq,
+}
+ADD_ANOTHER_ROUTES = {
+    'add_another_yes': select_order_type,
+    'confirm_cart': confirm_cart,
+}
+CONFIRM_CART_ROUTES = {
+    'place_order': place_order,
+    'cancel_cart': cancel_cart,
+}
+PROFILE_ROUTES = {
+    'profile_back': main_menu,
+    'back_to_main': main_menu,
+    'profile_orders': profile_show_orders,
+    'profile_feedbacks': profile_show_feedbacks,
+    'profile_feedback_add': profile_prompt_feedback,
+    'profile_referrals': profile_show_referrals,
+    'profile_bonuses': profile_show_bonuses,
+}
+# Маршруты вида «<префикс>_<id>»: обработчик получает хвост после последнего «_»
+PROFILE_TARGET_ROUTES = {
+    'profile_order_pause': profile_toggle_order_pause,
+    'profile_order_delete': profile_delete_order,
+    'profile_order_remind': profile_remind_order,
+    'profile_order': profile_show_order_detail,
+    'profile_feedback_delete': profile_delete_feedback,
+}
+ADMIN_MENU_ROUTES = {
+    'admin_menu': show_admin_menu,
+    'admin_orders': admin_show_orders,
+    'admin_recent_orders': admin_show_recent_orders,
+    'admin_leads': admin_show_leads,
+    'admin_bonuses': admin_show_bonuses,
+    'admin_prices': admin_show_prices,
+    'admin_price_mode': admin_toggle_pricing_mode,
+    'admin_export': admin_export_orders,
+    'back_to_main': main_menu,
+}
+ADMIN_TARGET_ROUTES = {
+    'admin_bonus_user': admin_view_bonus_user,
+    'admin_bonus_credit': functools.partial(admin_prompt_manual_bonus, mode='credit'),
+    'admin_bonus_debit': functools.partial(admin_prompt_manual_bonus, mode='debit'),
+}
+# Коды статусов и ключи типов сами содержат «_» (in_progress, kursovaya_s_empirikov),
+# поэтому колбэки с несколькими полями разбираем регуляркой, а не split('_')
+ADMIN_ORDER_CB_RE = re.compile(
+    r'admin_(?P<op>view|delete|order_bonus|status)_(?P<user_id>-?\d+)_(?P<order_id>\d+)(?:_(?P<status_code>\w+))?$'
+)
+ADMIN_PRICE_CB_RE = re.compile(
+    r'admin_price_(?P<op>adj|set)_(?P<order_type>\w+)_(?P<field>base|min)(?:_(?P<delta>-?\d+))?$'
+)
+ADMIN_ORDER_OPS = {
+    'view': admin_view_order,
+    'delete': admin_delete_order,
+    'order_bonus': admin_handle_order_bonus_request,
+}
+
+
+# Фильтры и шаблоны собираются один раз при импорте, а не при каждой сборке приложения
+TEXT_NO_CMD = filters.TEXT & ~filters.COMMAND
+FILE_UPLOAD_FILTER = (
+    filters.Document.ALL
+    | filters.PHOTO
+    | filters.AUDIO
+    | filters.VOICE
+    | filters.VIDEO
+    | filters.VIDEO_NOTE
+    | filters.ANIMATION
+    | filters.Sticker.ALL
+)
+REQUIREMENTS_CALLBACK_RE = re.compile(r'^requirements_(hint|skip)$')
+FILES_CALLBACK_RE = re.compile(r'^files_(done|skip)$')
+
+
+MAX_CONCURRENT_UPDATES = 64
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Разные чаты обрабатываются параллельно, апдейты одного чата — строго по очереди."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = {}
+        self._update_slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+
+    async def process_update(self, update, coroutine) -> None:
+        # Сначала очередь чата, потом общий слот: апдейты, ждущие свой чат (альбом, спам кнопкой),
+        # не занимают слоты и не останавливают остальные чаты
+        chat_key = None
+        if isinstance(update, Update):
+            if update.effective_chat:
+                chat_key = update.effective_chat.id
+            elif update.effective_user:
+                chat_key = update.effective_user.id
+        if chat_key is None:
+            async with self._update_slots:
+                await self.do_process_update(update, coroutine)
+            return
+        entry = self._chat_locks.get(chat_key)
+        if entry is None:
+            entry = self._chat_locks[chat_key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._update_slots:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_key]
+
+    async def do_process_update(self, update, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+async def post_init(application) -> None:
+    # get_me уже выполнен при инициализации бота — запоминаем имя для реферальных ссылок
+    remember_bot_username(application.bot_data, application.bot.username)
+    await start_admin_notifications(application)
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(compact_order_log, interval=ORDERS_LOG_COMPACT_INTERVAL)
+
+
+async def post_stop(application) -> None:
+    await stop_admin_notifications(application)
+    if _background_tasks:
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+
+
+async def post_shutdown(application) -> None:
+    if _save_tasks:
+        await asyncio.gather(*_save_tasks, return_exceptions=True)
+    flush_pending_saves()
+    if os.path.exists(ORDERS_LOG_FILE):
+        save_json(ORDERS_FILE, ORDERS)
+    await drain_user_log()
+
+
+async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ud = context.user_data
+    if ud is None:
+        return
+    for key in CONVERSATION_DRAFT_KEYS:
+        ud.pop(key, None)
+
+
+def build_conversation_persistence() -> PicklePersistence:
+    # Сохраняем только состояние диалогов и user_data: заказы, бонусы и прочие данные живут в своих файлах
+    return PicklePersistence(
+        filepath=CONVERSATION_STATE_FILE,
+        store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+        update_interval=CONVERSATION_STATE_FLUSH_INTERVAL,
+    )
+
+
+def build_application():
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .rate_limiter(AIORateLimiter())
+        .persistence(build_conversation_persistence())
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start), CommandHandler('admin', admin_start)],
         states={
             SELECT_MAIN_MENU: [CallbackQueryHandler(main_menu_handler)],
             SELECT_ORDER_TYPE: [CallbackQueryHandler(select_order_type)],
             VIEW_ORDER_DETAILS: [CallbackQueryHandler(view_order_details)],
-            INPUT_TOPIC: [MessageHandler(filters.TEXT & ~filters.COMMAND, input_topic)],
+            INPUT_TOPIC: [MessageHandler(TEXT_NO_CMD, input_topic)],
             SELECT_DEADLINE: [CallbackQueryHandler(select_deadline)],
             INPUT_REQUIREMENTS: [
-                CallbackQueryHandler(requirements_button_handler, pattern='^requirements_(hint|skip)$'),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, input_requirements),
+                CallbackQueryHandler(requirements_button_handler, pattern=REQUIREMENTS_CALLBACK_RE),
+                MessageHandler(TEXT_NO_CMD, input_requirements),
                 CommandHandler('skip', skip_requirements),
             ],
-            INPUT_CONTACT: [MessageHandler(filters.TEXT & ~filters.COMMAND, input_contact)],
+            INPUT_CONTACT: [MessageHandler(TEXT_NO_CMD, input_contact)],
             UPLOAD_FILES: [
-                CallbackQueryHandler(file_upload_action, pattern='^files_(done|skip)$'),
-                MessageHandler(
-                    (
-                        filters.Document.ALL
-                        | filters.PHOTO
-                        | filters.AUDIO
-                        | filters.VOICE
-                        | filters.VIDEO
-                        | filters.VIDEO_NOTE
-                        | filters.ANIMATION
-                        | filters.Sticker.ALL
-                    ),
-                    handle_file_upload,
-                ),
+                CallbackQueryHandler(file_upload_action, pattern=FILES_CALLBACK_RE),
+                MessageHandler(FILE_UPLOAD_FILTER, handle_file_upload),
                 CommandHandler('skip', skip_file_upload),
                 CommandHandler('done', skip_file_upload),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, remind_file_upload),
+                MessageHandler(TEXT_NO_CMD, remind_file_upload),
             ],
             ADD_UPSSELL: [CallbackQueryHandler(upsell_handler)],
             ADD_ANOTHER_ORDER: [CallbackQueryHandler(add_another_handler)],
             CONFIRM_CART: [CallbackQueryHandler(confirm_cart_handler)],
-            ADMIN_MENU: [CallbackQueryHandler(admin_menu_handler), MessageHandler(filters.TEXT & ~filters.COMMAND, admin_message)],
+            ADMIN_MENU: [CallbackQueryHandler(admin_menu_handler), MessageHandler(TEXT_NO_CMD, admin_message)],
             PROFILE_MENU: [CallbackQueryHandler(show_profile)],
             PROFILE_ORDERS: [CallbackQueryHandler(show_profile)],
             PROFILE_ORDER_DETAIL: [CallbackQueryHandler(show_profile)],
@@ -3416,15 +4566,42 @@ def main():
             SHOW_FAQ: [CallbackQueryHandler(show_faq)],
             FAQ_DETAILS: [CallbackQueryHandler(show_faq)],
             PROFILE_FEEDBACK_INPUT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, input_feedback),
+                MessageHandler(TEXT_NO_CMD, input_feedback),
                 CallbackQueryHandler(show_profile),
             ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
         },
         fallbacks=[CommandHandler('start', start)],
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        name='main_conversation',
+        persistent=True,
     )
     application.add_handler(conv_handler)
     application.add_error_handler(error_handler)
-    application.run_polling(drop_pending_updates=True)
+    return application
+
+
+# Основная функция
+def main():
+    if not TELEGRAM_BOT_TOKEN:
+        logger.error(
+            "Не задан TELEGRAM_BOT_TOKEN. Укажите токен бота в файле .env перед запуском."
+        )
+        raise SystemExit(1)
+    application = build_application()
+    if WEBHOOK_URL:
+        logger.info(f"Запуск в режиме webhook: {WEBHOOK_URL}/{WEBHOOK_PATH}, порт {WEBHOOK_PORT}")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=True,
+        )
+    else:
+        application.run_polling(drop_pending_updates=True, allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
     main()
@@ -66,9 +66,7 @@ migrate_data_file() {
     fi
 }
 
-migrate_data_file "orders.json" "$APP_DIR/data"
 migrate_data_file "prices.json" "$APP_DIR/data"
-migrate_data_file "user_logs.json" "$APP_DIR/data"
 migrate_data_file "orders.xlsx" "$APP_DIR/data"
 
 if [[ ! -d "$VENV_DIR" ]]; then